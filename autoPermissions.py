@@ -1,30 +1,10 @@
 #!/usr/bin/env python3
 
-import json, requests, re
-
-debug = False
-
-port = 9092
-user = 'test'
-pw = 'tset'
-
-def debugDump(label, data):
-	if not debug: return
-	print(label, json.dumps(data, sort_keys=True, indent=4))
-
-def sendRequest(function, data = None):
-	url = 'http://127.0.0.1:' + str(port) + function
-
-	debugDump('POST: ' + url, data)
-	resp = requests.post(url=url, json=data, auth=(user, pw))
-
-	# gracefully add 401 error
-	if resp.status_code == 401:
-		return {'retval': False}
-
-	debugDump('RESP', resp.json())
-	return resp.json()
-
+import re, os, json, copy, time, hashlib, argparse
+from rsApi import rsHost, rsHostAsync
+from rsFriends import rsFriendSnapshot, fetch_friend_snapshot
+from rsState import rsStateFile
+from rsTiers import tiers
 
 # curl -u 'test:tset' --data '{"mId":"rsMsgs/getMessage"}' --silent http://127.0.0.1:9092/rsServiceControl/getOwnServices | grep mServiceName | sed -e 's/mServiceName":\s"//g' -e 's/"/'"'"'/g' -e 's/,/: False,/g' -e 's/\s\s//g'
 # 'disc': False,
@@ -100,52 +80,177 @@ presets = {
 	}
 }
 
-def matchGraveyard(val):
-	if not val:
-		return False
-	return val == 'Graveyard'
-
-def matchHidden(val):
-	if not val:
-		return False
-	return re.search('.+\.onion$|.+\.b32\.i2p$', val) is not None
-
-def matchName(val):
-	if not val:
-		return False
-	return re.search('.*test.*', val) is not None
-
+# rules are applied in order, a later rule overrides an earlier one for the same service and peer.
+# 'perms' is either the name of a preset or a dict of its own.
+# types:
+#   group:   'group' (exact name) or 'pattern' (regex) on the group name, applies to all locations of its members
+#   address: 'pattern' on the hidden address, or the connected / latest tracked address
+#   name:    'pattern' on the (pgp) peer name
+# The same can be loaded from a json (or yaml, needs PyYAML) file, see rulesPath:
+#   {"presets": {"noTurtle": {"turtle": false}}, "rules": [{"type": "name", "pattern": "test", "perms": "noTurtle"}]}
 rules = [
-	{
-		# group: match group name
+	# one rule per graveyard tier (see rsTiers.tiers) that has a preset
+	*[{
 		'type': 'group',
-		'criterion': matchGraveyard,
-		'perms': presets['Graveyard']
-	},
+		'group': tier['group'],
+		'perms': tier['preset']
+	} for tier in tiers if tier.get('preset')],
 	{
-		# address: match address
-		# tries to match connected address or latest tracked
 		'type': 'address',
-		'criterion': matchHidden,
-		'perms': presets['hidden']
+		'pattern': r'.+\.onion$|.+\.b32\.i2p$',
+		'perms': 'hidden'
 	},
 	{
-		# match (pgp) peer name
 		'type': 'name',
-		'criterion': matchName,
+		'pattern': '.*test.*',
 		'perms': {
 			'turtle': False,
 		}
 	}
 ]
 
+# used instead of the rules above when it exists, reloaded whenever it changes
+rulesPath = '~/.autoPermissions.json'
+
+ruleTypes = ['group', 'address', 'name']
+
+# what every peer looked like when it was last evaluated, so the next run only looks at changed peers
+statePath = '~/.autoPermissions.state.json'
+fullReconcile = 24 # hours
+
+# rsEvents (see RsEventType / RsFriendListEventCode)
+FRIEND_LIST = 18
+FRIEND_ADDED = 1
+
+
+class rsRuleSet:
+	def __init__(self, rules: list, presets: dict):
+		# rules with resolved perms
+		self.rules = []
+		# type -> [(rule index, compiled pattern)]
+		patterns = {t: [] for t in ruleTypes}
+
+		for n, rule in enumerate(rules):
+			kind = rule.get('type')
+			if kind not in ruleTypes:
+				raise ValueError('rule ' + str(n) + ': unknown type ' + str(kind))
+			perms = rule.get('perms')
+			if isinstance(perms, str):
+				if perms not in presets:
+					raise ValueError('rule ' + str(n) + ': unknown preset ' + perms)
+				perms = presets[perms]
+			if not isinstance(perms, dict):
+				raise ValueError('rule ' + str(n) + ': perms must be a preset name or a dict')
+			rule = dict(rule, perms=perms)
+
+			if 'pattern' in rule:
+				try:
+					patterns[kind].append((n, re.compile(rule['pattern'])))
+				except re.error as e:
+					raise ValueError('rule ' + str(n) + ': ' + str(e))
+			elif kind != 'group' or 'group' not in rule:
+				raise ValueError('rule ' + str(n) + ': needs a pattern')
+			self.rules.append(rule)
+
+		# type -> function returning the indices of all rules matching a value
+		self.matchers = {kind: combine(compiled) for kind, compiled in patterns.items()}
+		# changes whenever a rule or a preset it uses changes
+		self.key = digest(self.rules)
+
+	def hasType(self, kind: str) -> bool:
+		return any(rule['type'] == kind for rule in self.rules)
+
+	@classmethod
+	def fromFile(cls, path: str):
+		with open(path) as f:
+			if path.endswith(('.yaml', '.yml')):
+				try:
+					import yaml
+				except ImportError:
+					raise ValueError('reading ' + path + ' needs PyYAML')
+				data = yaml.safe_load(f)
+			else:
+				data = json.load(f)
+		if isinstance(data, list):
+			data = {'rules': data}
+		return cls(data.get('rules', []), dict(presets, **data.get('presets', {})))
+
+	def match(self, kind: str, values: list) -> set:
+		matcher = self.matchers[kind]
+		found = set()
+		for val in values:
+			if val:
+				found.update(matcher(val))
+		return found
+
+
+# flags of a pattern without inline flags
+defaultFlags = re.compile('').flags
+
+def combine(compiled: list):
+	# all patterns of one type in a single regex: one optional lookahead per pattern,
+	# a group is set if its pattern is found anywhere in the value (same as re.search)
+	# patterns with groups of their own (backreferences count them) or flags would change their meaning
+	# in there, they are tested one by one
+	plain = [(n, p) for n, p in compiled if p.groups == 0 and p.flags == defaultFlags]
+	single = [(n, p) for n, p in compiled if (n, p) not in plain]
+	combined = None
+	if plain:
+		combined = re.compile(''.join('(?:(?=(?P<r%d>[\\s\\S]*?(?:%s))))?' % (n, p.pattern) for n, p in plain))
+	indices = [(('r%d' % n), n) for n, _ in plain]
+
+	def match(val):
+		found = []
+		if combined is not None:
+			groups = combined.match(val).groupdict()
+			found = [n for name, n in indices if groups[name] is not None]
+		found += [n for n, p in single if p.search(val)]
+		return found
+	return match
+
+
+def digest(data) -> str:
+	return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+# path -> (mtime, rsRuleSet)
+_loaded = {}
+
+def loadRules(path: str = None) -> rsRuleSet:
+	path = os.path.expanduser(path or rulesPath)
+	if not os.path.exists(path):
+		path = None
+		mtime = None
+	else:
+		mtime = os.stat(path).st_mtime_ns
+
+	cached = _loaded.get(path)
+	if cached is not None and cached[0] == mtime:
+		return cached[1]
+
+	if path is None:
+		ruleSet = rsRuleSet(rules, presets)
+	else:
+		print('loading rules from ' + path)
+		try:
+			ruleSet = rsRuleSet.fromFile(path)
+		except (OSError, ValueError) as e:
+			if cached is None:
+				raise
+			# keep going with what worked before
+			print('failed to load ' + path + ': ' + str(e))
+			return cached[1]
+	_loaded[path] = (mtime, ruleSet)
+	return ruleSet
+
 
 class rsServicePerms:
-	def __init__(self):
+	def __init__(self, rs: rsHost):
 		self.names = {}
 		self.services = {}
+		self.rs = rs
 
-		resp = sendRequest('/rsServiceControl/getOwnServices')
+		resp = self.rs.sendRequest('/rsServiceControl/getOwnServices')
 		for service in resp['info']['mServiceList']:
 			name = service["value"]["mServiceName"]
 			id = service["key"]
@@ -159,106 +264,255 @@ class rsServicePerms:
 		else:
 			return -1
 
-	def setPerms(self, perms, sslId):
-		print('setting perms for ' + sslId)
-		# print(perms)
-		for name, allowed in perms.items():
-			# get perm from RS
-			req = {'serviceId': self.getId(name)}
-			resp = sendRequest('/rsServiceControl/getServicePermissions', req)
-			if not resp['retval']:
+	def getPerms(self, id):
+		resp = self.rs.sendRequest('/rsServiceControl/getServicePermissions', {'serviceId': id})
+		if not resp['retval']:
+			return None
+		return resp['permissions']
+
+	def update(self, id, current, desired, dryRun=False):
+		# only talk to RS when something changes, returns whether it did (or would)
+		delta = permsDelta(current, desired)
+		if not delta:
+			return False
+		print(self.services[id]['mServiceName'] + ': ' + ', '.join(delta))
+		if not dryRun:
+			self.rs.sendRequest('/rsServiceControl/updateServicePermissions', {'serviceId': id, 'permissions': desired})
+		return True
+
+	def apply(self, plan, dryRun=False):
+		# one read and at most one write per service, no matter how many peers and rules
+		changed = 0
+		for name, peers in plan.desired.items():
+			id = self.getId(name)
+			if id == -1:
+				continue
+			current = self.getPerms(id)
+			if current is None:
 				continue
-			p = resp['permissions']
-
-			if p['mDefaultAllowed']:
-				# manage blacklist
-				if allowed:
-					if sslId in p['mPeersDenied']:
-						p['mPeersDenied'].remove(sslId)
-				else:
-					p['mPeersDenied'].append(sslId)
-			else:
-				# manage whitelist
-				if allowed:
-					p['mPeersAllowed'].append(sslId)
-				else:
-					if sslId in p['mPeersAllowed']:
-						p['mPeersAllowed'].remove(sslId)
-					
-			# update req
-			req['permissions'] = p
-			sendRequest('/rsServiceControl/updateServicePermissions', req)
 
+			p = cleanPerms(current)
+			for sslId, allowed in peers.items():
+				setPerm(p, sslId, allowed)
 
+			if self.update(id, current, p, dryRun):
+				changed += 1
+		print(('would update ' if dryRun else 'updated ') + str(changed) + ' of ' + str(len(plan.desired)) + ' services')
+		return changed
 
-if __name__ == "__main__":
-	perms = rsServicePerms()
-	peers = sendRequest('/rsPeers/getFriendList')['sslIds']
-	groups = sendRequest('/rsPeers/getGroupInfoList')['groupInfoList']
+
+class rsPermissionPlan:
+	def __init__(self):
+		# service name -> {sslId: allowed}, later rules win
+		self.desired = {}
+
+	def setPerms(self, perms, sslId):
+		print('setting perms for ' + sslId)
+		for name, allowed in perms.items():
+			self.desired.setdefault(name, {})[sslId] = allowed
+
+
+def cleanPerms(p):
+	# copy without duplicate entries (older versions of this script appended blindly)
+	p = copy.deepcopy(p)
+	p['mPeersDenied'] = list(dict.fromkeys(p['mPeersDenied']))
+	p['mPeersAllowed'] = list(dict.fromkeys(p['mPeersAllowed']))
+	return p
+
+
+def setPerm(p, sslId, allowed):
+	if p['mDefaultAllowed']:
+		# manage blacklist
+		if allowed:
+			if sslId in p['mPeersDenied']:
+				p['mPeersDenied'].remove(sslId)
+		elif sslId not in p['mPeersDenied']:
+			p['mPeersDenied'].append(sslId)
+	else:
+		# manage whitelist
+		if allowed:
+			if sslId not in p['mPeersAllowed']:
+				p['mPeersAllowed'].append(sslId)
+		else:
+			if sslId in p['mPeersAllowed']:
+				p['mPeersAllowed'].remove(sslId)
+
+
+def permsDelta(current, desired):
+	# human readable difference between two permission sets, empty when there is none
+	delta = []
+	for key in ['mServiceId', 'mServiceName']:
+		if current.get(key) != desired.get(key):
+			delta.append(key + ' ' + str(desired.get(key)))
+	if current['mDefaultAllowed'] != desired['mDefaultAllowed']:
+		delta.append('default ' + ('allowed' if desired['mDefaultAllowed'] else 'denied'))
+	for key, label in [('mPeersDenied', 'denied'), ('mPeersAllowed', 'allowed')]:
+		old, new = current[key], desired[key]
+		added = [sslId for sslId in new if sslId not in old]
+		removed = set(old) - set(new)
+		if added:
+			delta.append('+' + str(len(added)) + ' ' + label)
+		if removed:
+			delta.append('-' + str(len(removed)) + ' ' + label)
+		if len(old) != len(set(old)):
+			delta.append(str(len(old) - len(set(old))) + ' duplicate ' + label)
+	return delta
+
+
+class rsPermissionState(rsStateFile):
+	fields = ['rules', 'peers', 'lastFull']
+
+	def __init__(self, path: str):
+		super().__init__(path)
+		# key of the rule set the peers were evaluated with
+		self.rules = None
+		# sslId -> [fingerprint of everything the rules look at, gpg_id, indices of the group rules covering it]
+		self.peers = {}
+		self.lastFull = 0
+		self.load()
+
+	def valid(self, data: dict) -> bool:
+		# written by an older version, without gpg_id -> start over
+		return isinstance(data['peers'], dict) and all(isinstance(entry, list) and len(entry) == 3 for entry in data['peers'].values())
+
+	def needsFull(self, ruleSet: rsRuleSet, now: float) -> bool:
+		return not self.peers or self.rules != ruleSet.key or now - self.lastFull > fullReconcile * 3600
+
+	def prune(self, friends: list):
+		current = set(friends)
+		self.peers = {sslId: entry for sslId, entry in self.peers.items() if sslId in current}
+
+	def fingerprint(self, sslId: str) -> str:
+		entry = self.peers.get(sslId)
+		return entry[0] if entry is not None else None
+
+	def regrouped(self, byGpgId: dict) -> list:
+		# known locations whose pgp id is now covered by other group rules than when they were evaluated
+		return [sslId for sslId, (_, gpgId, groupRules) in self.peers.items() if sorted(byGpgId.get(gpgId, ())) != groupRules]
+
+
+def peerAddresses(d: dict) -> list:
+	# connected address or latest on record
+	if d['isHiddenNode']:
+		return [d['hiddenNodeAddress']]
+	return [d['connectAddr']] + d['ipAddressList'][:1]
+
+
+def fingerprint(d: dict, groupRules: set) -> str:
+	return digest([d['name'], peerAddresses(d), sorted(groupRules)])
+
+
+def groupsByName(groups) -> dict:
+	# name -> group info
+	return {group['name']: group for group in groups}
+
+
+def matchingGroups(ruleSet: rsRuleSet, groups: dict) -> dict:
+	# group rule index -> matching groups, exact names are looked up directly
+	matching = {}
+	patterns = False
+	for n, rule in enumerate(ruleSet.rules):
+		if rule['type'] != 'group':
+			continue
+		if 'pattern' in rule:
+			patterns = True
+		elif rule['group'] in groups:
+			matching[n] = [groups[rule['group']]]
+	if patterns:
+		for group in groups.values():
+			for n in ruleSet.match('group', [group['name']]):
+				matching.setdefault(n, []).append(group)
+	return matching
+
+
+def run(ars: rsHostAsync, snap: rsFriendSnapshot = None, dryRun: bool = False, rulesFile: str = None, full: bool = False):
+	rs = ars.rs
+	now = time.time()
+	ruleSet = loadRules(rulesFile)
+	plan = rsPermissionPlan()
+	state = rsPermissionState(statePath)
+	full = full or state.needsFull(ruleSet, now)
+
+	# groups: gpg_id -> indices of the group rules covering it
+	# (fetched every run, buryTheDead moves friends around between them)
+	byGpgId = {}
+	if ruleSet.hasType('group'):
+		# streamed, on big nodes this is the largest response of the run
+		groups = groupsByName(rs.iterRequest('/rsPeers/getGroupInfoList', 'groupInfoList'))
+		for n, matched in matchingGroups(ruleSet, groups).items():
+			for group in matched:
+				for peer in group['peerIds']:
+					byGpgId.setdefault(peer, set()).add(n)
 
 	# cache details
-	details = {}
-	for peer in peers:
-		# get details
-		req = {'sslId': peer}
-		resp = sendRequest('/rsPeers/getPeerDetails', req)
-		if not resp['retval']:
+	if snap is None:
+		friends = rs.sendRequest('/rsPeers/getFriendList')['sslIds']
+		state.prune(friends)
+		# without a full run only new friends and those that changed groups need their details
+		if not full:
+			friends = [f for f in friends if f not in state.peers] + state.regrouped(byGpgId)
+		snap = fetch_friend_snapshot(ars, friends)
+	else:
+		state.prune(snap.sslIds())
+	details = snap.details
+
+	# one pass over all (changed) peers, every type of rule is a single regex per value
+	evaluated = 0
+	for peer in snap.sslIds():
+		d = details[peer]
+		groupRules = byGpgId.get(d['gpg_id'], set())
+		fp = fingerprint(d, groupRules)
+		if not full and state.fingerprint(peer) == fp:
 			continue
-		details[peer] = resp['det']
-
-	# go through rules
-	for rule in rules:
-		# ##################################################
-		# groups
-		# ##################################################
-		if   rule['type'] is 'group':
-			# find matching group
-			for group in groups:
-				if rule['criterion'](group['name']):
-					print('found matching group ' + group['name'])
-					peerIds = group['peerIds']
-	
-					if not peerIds:
-						continue
-
-					# we have a list of peers that match a group for the current rule
-					# now apply permissions
-					print('got ' + str(len(peerIds)) + ' pgpIds')
-					for peer in peerIds:						
-						# get sslIds
-						for id, d in details.items():
-							if d['gpg_id'] == peer:
-								perms.setPerms(rule['perms'], id)
-
-		# ##################################################
-		# address
-		# ##################################################
-		elif rule['type'] is 'address':			
-
-			for peer in peers:
-				d = details[peer]
-				# check for connected address or latest on record
-				match = False
-				if d['isHiddenNode']:
-					match = match or rule['criterion'](d['hiddenNodeAddress'])
-				else:
-					match = match or rule['criterion'](d['connectAddr'])
-					match = match or (d['ipAddressList'] and rule['criterion'](d['ipAddressList'][0]))
-
-				if not match: 
-					continue
-				print('found matching address ' + d['name'] + '/' + d['location'])
-				perms.setPerms(rule['perms'], peer)
-
-		# ##################################################
-		# name
-		# ##################################################
-		elif rule['type'] is 'name':			
-
-			for peer in peers:
-				d = details[peer]
-
-				if not rule['criterion'](d['name']): 
-					continue
-				print('found matching name ' + d['name'] + '/' + d['location'])
-				perms.setPerms(rule['perms'], peer)
+		state.peers[peer] = [fp, d['gpg_id'], sorted(groupRules)]
+		evaluated += 1
+
+		matched = set(groupRules)
+		matched |= ruleSet.match('address', peerAddresses(d))
+		matched |= ruleSet.match('name', [d['name']])
+
+		# keep the rule order, later rules win
+		for n in sorted(matched):
+			rule = ruleSet.rules[n]
+			print('found matching ' + rule['type'] + ' ' + d['name'] + '/' + d['location'])
+			plan.setPerms(rule['perms'], peer)
+	print('evaluated ' + str(evaluated) + ' of ' + str(len(state.peers)) + ' friends' + (' (full)' if full else ''))
+
+	# now talk to RS, once per service and only where something changes
+	if plan.desired:
+		rsServicePerms(rs).apply(plan, dryRun)
+
+	if not dryRun:
+		state.rules = ruleSet.key
+		if full:
+			state.lastFull = now
+		state.save()
+
+
+def isFriendAdded(event: dict) -> bool:
+	return event.get('mType') == FRIEND_LIST and event.get('mEventCode') == FRIEND_ADDED
+
+
+def follow(ars: rsHostAsync, rulesFile: str = None):
+	# evaluate new friends as soon as they are added
+	for event in ars.rs.getEventsStream(FRIEND_LIST):
+		if isFriendAdded(event):
+			run(ars, rulesFile=rulesFile)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='applies service permission rules')
+	parser.add_argument('--dry-run', help='only print what would change', action='store_true', dest='dryRun')
+	parser.add_argument('--rules', help='json/yaml rule file (default ' + rulesPath + ' if it exists, else the built-in rules)')
+	parser.add_argument('--full', help='evaluate all friends, not only new or changed ones', action='store_true')
+	parser.add_argument('--follow', help='keep running and evaluate friends when they are added', action='store_true')
+	args, _ = parser.parse_known_args()
+
+	ars = rsHostAsync()
+	run(ars, dryRun=args.dryRun, rulesFile=args.rules, full=args.full)
+	if args.follow:
+		follow(ars, args.rules)
+
+
+if __name__ == "__main__":
+	main()
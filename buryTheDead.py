@@ -1,54 +1,18 @@
 #!/usr/bin/env python3
 
-import json, requests, time, math, argparse
+import time, math, argparse
+from rsApi import rsHost, rsHostAsync
+from rsFriends import rsFriendSnapshot, fetch_friend_snapshot
+from rsState import rsStateFile
+from rsTiers import tiers
 
-debug = False
-
-groupName = "Graveyard"
-offlineLimit = 30 # days
-
-def debugDump(label, data):
-	if not debug: return
-	print(label, json.dumps(data, sort_keys=True, indent=4))
-
-
-class rsHost:
-	_ip = '127.0.0.1'
-	_port = '9092'
-	_auth = ('test', 'tset')
-
-	def __init__(self):
-		parser = argparse.ArgumentParser(description='reads standard RS json API parameters.')
-		parser.add_argument('--port', '-p', help='json api port')
-		parser.add_argument('--addr', '-a', help='json api address')
-		parser.add_argument('--user', '-u', help='json api user')
-		parser.add_argument('--pass', '-P', help='json api password', dest='pw')
-		args = parser.parse_args()
-
-		# print(args)
-
-		if args.addr is not None:
-			self._ip = args.addr
-		if args.port is not None:
-			self._port = args.port
-		if args.user is not None and args.pw is not None:
-			self._auth = (args.user, args.pw)
-
-		pass
-
-	def sendRequest(self, function, data=None):
-		url = 'http://' + self._ip + ':' + self._port + function
-
-		debugDump('POST: ' + url, data)
-		resp = requests.post(url=url, json=data, auth=self._auth)
-
-		# gracefully add 401 error
-		if resp.status_code == 401:
-			return {'retval': False}
-
-		debugDump('RESP', resp.json())
-		return resp.json()
+# rsEvents (see RsEventType / RsConnectionEventCode)
+PEER_CONNECTION = 4
+PEER_CONNECTED = 1
 
+# what was seen last run, so the next one only needs to look at a few peers
+statePath = '~/.buryTheDead.json'
+fullReconcile = 24 # hours
 
 class rsGroup:
 	def __init__(self, rs : rsHost, name : str):
@@ -125,74 +89,201 @@ class rsGroup:
 		req = {'groupName': self.name}
 		self.info = self.rs.sendRequest('/rsPeers/getGroupInfoByName', req)['groupInfo']
 
-def getDays(details):
-	days = time.time() - details['lastConnect']
+def getDays(details, now: float = None):
+	if now is None:
+		now = time.time()
+	days = now - details['lastConnect']
 	days = days / 3600 / 24
 	days = math.ceil(days)
 	return days
 
-if __name__ == "__main__":
-	rs = rsHost()
-
-	group   = rsGroup(rs, groupName)
-	friends = rs.sendRequest('/rsPeers/getFriendList')['sslIds']
-
-	# we go though the list of locations
-	# -> we can have one friend with long time offline locations and recent locations
-	# -> first move to group then remove
-	toAdd = []
-	toRemove = []
-	names = {}
-	days = {}
-
-	# add long offline friends
-	for friend in friends:
-		req = {'sslId': friend}
-		details = rs.sendRequest('/rsPeers/getPeerDetails', req)['det']
-		pgpId = details['gpg_id']
-
-		d = getDays(details)
-
-		if d > offlineLimit:
-			if not pgpId in toAdd:
-				toAdd.append(pgpId)
-				names[pgpId] = details["name"]
-				days[pgpId] = d
-
-	# remove recent online friends
-	for friend in friends:
-		req = {'sslId': friend}
-		details = rs.sendRequest('/rsPeers/getPeerDetails', req)['det']
-		pgpId = details['gpg_id']
-
-		d = getDays(details)
-
-		if d < offlineLimit:
-			if pgpId in toAdd:
-				toAdd.remove(pgpId)
-			if group.isAssigned(pgpId):
-				toRemove.append(pgpId)
-				names[pgpId] = details["name"]
-				days[pgpId] = d
-
-	# ensure we have an updated peer list
-	group.update()
-
-	# toAdd now contains only the peers that are too long offline (excluding those with one recent online and one too long offline location)
-	for pgpId in toAdd:
-		if not group.isAssigned(pgpId):
-			print("burrying " + names[pgpId] + "\t(offline for " + str(days[pgpId]) + " days)")
-		else:
-			toAdd.remove(pgpId)
-	group.addPeers(toAdd)
-
-	# ensure we have an updated peer list
-	group.update()
+class rsGraveyardState(rsStateFile):
+	fields = ['tiers', 'peers', 'locations', 'assigned', 'lastRun', 'lastFull']
+
+	def __init__(self, path: str):
+		super().__init__(path)
+		self.tiers = tierKey()
+		# pgp id -> {'lastConnect': ..., 'name': ...} of its most recent location
+		self.peers = {}
+		# sslId -> pgp id
+		self.locations = {}
+		# group -> pgp ids in the group after the last run
+		self.assigned = {}
+		self.lastRun = 0
+		self.lastFull = 0
+		self.load()
+
+	def valid(self, data: dict) -> bool:
+		# tiers changed -> start over
+		return data['tiers'] == tierKey()
+
+	def needsFull(self, now: float) -> bool:
+		return not self.peers or now - self.lastFull > fullReconcile * 3600
+
+	def reset(self, snap: rsFriendSnapshot, now: float):
+		self.peers = {}
+		self.locations = {}
+		self.merge(snap)
+		self.lastFull = now
+
+	def merge(self, snap: rsFriendSnapshot):
+		# the most recent location counts
+		# -> one recent location keeps a friend with long time offline locations alive
+		for sslId, details in snap.details.items():
+			pgpId = details['gpg_id']
+			self.locations[sslId] = pgpId
+			peer = self.peers.get(pgpId)
+			if peer is None or details['lastConnect'] > peer['lastConnect']:
+				self.peers[pgpId] = {'lastConnect': details['lastConnect'], 'name': details['name']}
+
+	def prune(self, friends: list):
+		current = set(friends)
+		for sslId in [sslId for sslId in self.locations if sslId not in current]:
+			del self.locations[sslId]
+		remaining = set(self.locations.values())
+		for pgpId in [pgpId for pgpId in self.peers if pgpId not in remaining]:
+			del self.peers[pgpId]
+
+	def touch(self, online: set, now: float):
+		# connected locations are seen right now, no need to ask for their details
+		for sslId in online:
+			pgpId = self.locations.get(sslId)
+			if pgpId is not None:
+				self.peers[pgpId]['lastConnect'] = max(self.peers[pgpId]['lastConnect'], int(now))
+
+	def candidates(self, friends: list, now: float) -> list:
+		# locations whose pgp id can have changed tier since the last run:
+		# unknown ones, those whose last connect crossed a tier limit in between
+		# and all buried ones (a few), which may have connected and gone again since the last run
+		def sides(lastConnect, t):
+			d = getDays({'lastConnect': lastConnect}, t)
+			return [(d > tier['days']) - (d < tier['days']) for tier in tiers]
+
+		crossed = {pgpId for pgpId, peer in self.peers.items()
+				if sides(peer['lastConnect'], self.lastRun) != sides(peer['lastConnect'], now)}
+		crossed |= set().union(*self.assigned.values())
+		return [sslId for sslId in friends
+				if sslId not in self.locations or self.locations[sslId] in crossed]
+
+
+def tierKey() -> list:
+	return [[tier['days'], tier['group']] for tier in tiers]
+
+def tierDeltas(days: dict, assigned: dict) -> dict:
+	# group -> (pgp ids to bury, pgp ids to unearth), for all tiers at once
+	ordered = sorted(tiers, key=lambda tier: tier['days'])
+	# the oldest tier a friend reached
+	target = {tier['group']: set() for tier in ordered}
+	for pgpId, d in days.items():
+		reached = [tier for tier in ordered if d > tier['days']]
+		if reached:
+			target[reached[-1]['group']].add(pgpId)
+
+	deltas = {}
+	for n, tier in enumerate(ordered):
+		group = tier['group']
+		members = assigned.get(group, set())
+		older = set().union(*[target[t['group']] for t in ordered[n + 1:]])
+		alive = {pgpId for pgpId, d in days.items() if d < tier['days']}
+		deltas[group] = (target[group] - members, members & (alive | older))
+	return deltas
+
+def run(ars: rsHostAsync, snap: rsFriendSnapshot = None, full: bool = False):
+	rs = ars.rs
+	now = time.time()
+
+	groups = {tier['group']: rsGroup(rs, tier['group']) for tier in tiers}
+	state = rsGraveyardState(statePath)
+
+	if snap is None:
+		friends = rs.sendRequest('/rsPeers/getFriendList')['sslIds']
+		if full or state.needsFull(now):
+			snap = fetch_friend_snapshot(ars, friends)
+
+	if snap is not None:
+		state.reset(snap, now)
+	else:
+		state.prune(friends)
+		state.touch(rs.sendRequest('/rsPeers/getOnlineList')['sslIds'], now)
+		state.merge(fetch_friend_snapshot(ars, state.candidates(friends, now)))
+
+	latest = state.peers
+	days = {pgpId: getDays(details, now) for pgpId, details in latest.items()}
+	assigned = {name: set(group.info['peerIds']) for name, group in groups.items()}
+	deltas = tierDeltas(days, assigned)
+
+	for name, (toAdd, toRemove) in deltas.items():
+		group = groups[name]
+		prefix = '' if len(tiers) == 1 else '[' + name + '] '
+
+		for pgpId in sorted(toAdd, key=lambda p: days[p]):
+			print(prefix + "burrying " + latest[pgpId]['name'] + "\t(offline for " + str(days[pgpId]) + " days)")
+		if toAdd:
+			group.addPeers(sorted(toAdd))
+
+		for pgpId in sorted(toRemove, key=lambda p: days[p]):
+			print(prefix + "unearthing " + latest[pgpId]['name'] + "\t(offline for " + str(days[pgpId]) + " days)")
+		if toRemove:
+			group.removePeers(sorted(toRemove))
+
+		state.assigned[name] = sorted((assigned[name] | toAdd) - toRemove)
+
+	state.lastRun = now
+	state.save()
+
+
+def follow(ars: rsHostAsync):
+	# unearth buried friends as soon as one of their locations connects
+	rs = ars.rs
+
+	groups = {tier['group']: rsGroup(rs, tier['group']) for tier in tiers}
+	print('watching ' + str(len(set().union(*[group.info['peerIds'] for group in groups.values()]))) + ' buried friends')
+
+	for event in rs.getEventsStream(PEER_CONNECTION):
+		if event.get('mConnectionInfoCode') != PEER_CONNECTED:
+			continue
+		now = time.time()
+		sslId = event['mSslId']
+
+		# bury runs (cron, daemon) change the state and the groups while this is running
+		state = rsGraveyardState(statePath)
+		pgpId = state.locations.get(sslId)
+		if pgpId is None:
+			resp = rs.sendRequest('/rsPeers/getPeerDetails', {'sslId': sslId})
+			if not resp['retval']:
+				continue
+			state.merge(rsFriendSnapshot.fromDetails({sslId: resp['det']}))
+			pgpId = resp['det']['gpg_id']
+		state.touch([sslId], now)
+
+		for name, group in groups.items():
+			group.update()
+			if not group.isAssigned(pgpId):
+				continue
+			group.removePeers([pgpId])
+			print("unearthing " + state.peers[pgpId]['name'] + "\t(connected again)")
+			state.assigned[name] = [p for p in state.assigned.get(name, []) if p != pgpId]
+		state.save()
+
+
+def main():
+	parser = argparse.ArgumentParser(description='moves long offline friends into the graveyard group(s)')
+	parser.add_argument('--full', help='look at all friends, not only those that can have changed', action='store_true')
+	parser.add_argument('--follow', help='keep running and unearth friends when they connect', action='store_true')
+	parser.add_argument('--tier', help='DAYS:GROUP, replaces the tiers configured in rsTiers (repeatable)', action='append', dest='tiers')
+	args, _ = parser.parse_known_args()
+
+	if args.tiers:
+		tiers.clear()
+		for tier in args.tiers:
+			days, group = tier.split(':', 1)
+			tiers.append({'days': int(days), 'group': group})
+
+	ars = rsHostAsync()
+	run(ars, full=args.full)
+	if args.follow:
+		follow(ars)
 
-	for pgpId in toRemove:
-		if group.isAssigned(pgpId):
-			print("unearthing " + names[pgpId] + "\t(offline for " + str(days[pgpId]) + " days)")
-		else:
-			toRemove.remove(pgpId)
-	group.removePeers(toRemove)
 
+if __name__ == "__main__":
+	main()
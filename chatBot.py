@@ -1,13 +1,12 @@
 #!/usr/bin/env python3
 
-import json, requests, html, argparse, re, html2text, random
+import json, html, re, random
 from enum import IntEnum
 from typing import Union
+from rsApi import rsHost
 # import signal
 # import sys
 
-debug = False
-
 # shouldStop = False
 
 # lobbyName = 'Retroshare Devel (signed)'
@@ -19,69 +18,6 @@ lobbies_to_auto_join = [
 ]
 
 
-def debugDump(label, data):
-	if not debug: return
-	print(label, json.dumps(data, sort_keys=True, indent=4))
-
-
-class rsHost:
-	# some defaults
-	_ip = '127.0.0.1'
-	_port = '9092'
-	_auth = ('test', 'tset')
-
-	def __init__(self):
-		parser = argparse.ArgumentParser(description='reads standard RS json API parameters.')
-		parser.add_argument('--port', '-p', help='json api port')
-		parser.add_argument('--addr', '-a', help='json api address')
-		parser.add_argument('--user', '-u', help='json api user')
-		parser.add_argument('--pass', '-P', help='json api password', dest='pw')
-		args, _ = parser.parse_known_args()
-
-		# print(args)
-
-		if args.addr is not None:
-			self._ip = args.addr
-		if args.port is not None:
-			self._port = args.port
-		if args.user is not None and args.pw is not None:
-			self._auth = (args.user, args.pw)
-
-		self._baseUrl = 'http://' + self._ip + ':' + self._port + '/'
-
-	def sendRequest(self, function, data=None):
-		if function[0] == '/': function = function[1:]
-		url = self._baseUrl + function
-
-		debugDump('POST: ' + url, data)
-		resp = requests.post(url=url, json=data, auth=self._auth)
-
-		# gracefully add 401 error
-		if resp.status_code == 401:
-			return {'retval': False}
-
-		debugDump('RESP', resp.json())
-		return resp.json()
-
-	def getEventsStream(self, eventType: int = 0):
-		from sseclient import SSEClient
-		for mRecord in SSEClient(
-				self._baseUrl + "/rsEvents/registerEventsHandler",
-				auth=self._auth,
-				json={"eventType": eventType}):
-			try:
-				mEvent = json.loads(mRecord.data)["event"]
-				## Older RetroShare version doesn't filter events type
-				if (mEvent["mType"] == eventType or eventType == 0):
-					yield mEvent
-			except(KeyError):
-				if json.loads(mRecord.data)["retval"]:
-					continue
-			except(TypeError):
-				print(mRecord)
-				print("Got invalid record:", mRecord.dump().encode("utf8"))
-
-
 class rsChatType(IntEnum):
 	TYPE_NOT_SET = 0
 	TYPE_PRIVATE = 1
@@ -94,6 +30,13 @@ class rsChatType(IntEnum):
 		return any(pattern == item.value for item in cls)
 
 
+def lobbyId(value) -> int:
+	# RS sends 64 bit ids as {'xint64': n, 'xstr64': 'n'}, the string is exact
+	if isinstance(value, dict):
+		value = value['xstr64']
+	return int(value)
+
+
 class rsChat:
 	def __init__(self, rs: rsHost, name: Union[str, None] = None):
 		self.id = -1
@@ -106,7 +49,7 @@ class rsChat:
 		# fetch chat info
 		idList = self.rs.sendRequest('/rsMsgs/getChatLobbyList')['cl_list']
 		for chatLobbyId in idList:
-			req = {'id': int(chatLobbyId)}
+			req = {'id': lobbyId(chatLobbyId)}
 			resp = self.rs.sendRequest('/rsMsgs/getChatLobbyInfo', req)
 
 			if not resp['retval']:
@@ -116,7 +59,7 @@ class rsChat:
 			# print(info['lobby_name'])
 
 			if info['lobby_name'] == name:
-				self.id = int(chatLobbyId)
+				self.id = lobbyId(chatLobbyId)
 				self.info = info
 				break
 
@@ -175,7 +118,7 @@ class rsBot:
 		self.rules = []
 
 	def run(self):
-		for event in rs.getEventsStream(15):
+		for event in self.rs.getEventsStream(15):
 			# print(event)
 			self._process_event(event['mChatMessage'])
 
@@ -184,22 +127,22 @@ class rsBot:
 
 	def _get_peer_name(self, peer_id: str) -> str:
 		req = {'sslId': peer_id}
-		details = rs.sendRequest('rsPeers/getPeerDetails', req)['det']
+		details = self.rs.sendRequest('rsPeers/getPeerDetails', req)['det']
 		return details['name']
 
 	def _get_gxs_id_name(self, gxs_id: str) -> str:
 		req = {'id': gxs_id}
-		details = rs.sendRequest('rsIdentity/getIdDetails', req)['details']
+		details = self.rs.sendRequest('rsIdentity/getIdDetails', req)['details']
 		return details['mNickname']
 
 	def _get_distant_peer_name(self, distant_id: str) -> str:
 		req = {'pid': distant_id}
-		info = rs.sendRequest('rsMsgs/getDistantChatStatus', req)['info']
+		info = self.rs.sendRequest('rsMsgs/getDistantChatStatus', req)['info']
 		to_id = info['to_id']
 		return self._get_gxs_id_name(to_id)
 
 	def _get_lobby_name(self, lobby_id: int) -> str:
-		req = {'id': lobby_id}
+		req = {'id': lobbyId(lobby_id)}
 		info = self.rs.sendRequest('/rsMsgs/getChatLobbyInfo', req)['info']
 		return info['lobby_name']
 
@@ -237,6 +180,7 @@ class rsBot:
 
 	def _process_message(self, chat_message: json, sender_name: str, lobby_name: Union[str, None] = None):
 		# get the plain text message
+		import html2text
 		h = html2text.HTML2Text()
 		# todo add more usefull options here
 		h.ignore_links = True
@@ -284,7 +228,7 @@ class rsBot:
 		# 	self.chat.send(response, chat_message['chat_id'])
 
 
-if __name__ == "__main__":
+def main():
 	# def signal_handler(sig, frame):
 	# 	global shouldStop
 	# 	print('You pressed Ctrl+C!')
@@ -318,3 +262,7 @@ if __name__ == "__main__":
 	bot.add_rule(rsBotRule('echo', True, '$$match_1', [re.compile('^!echo\s(.*)$', re.IGNORECASE)]))
 
 	bot.run()
+
+
+if __name__ == "__main__":
+	main()
@@ -1,58 +1,14 @@
 #!/usr/bin/env python3
 
-import json, requests, html, argparse
-from subprocess import check_output
-
-debug = False
+import html, io, sys, contextlib
+from rsApi import rsHost
 
 # lobbyName = 'Retroshare Devel (signed)'
 lobbyName = 'test'
 # lobbyName = 'testChat'
-# program = './ipOverview.py'
-program = './discOverview.py'
-
-def debugDump(label, data):
-	if not debug: return
-	print(label, json.dumps(data, sort_keys=True, indent=4))
-
-
-class rsHost:
-	_ip = '127.0.0.1'
-	_port = '9092'
-	_auth = ('test', 'tset')
-
-	def __init__(self):
-		parser = argparse.ArgumentParser(description='reads standard RS json API parameters.')
-		parser.add_argument('--port', '-p', dest='port')
-		parser.add_argument('--addr', '-a', dest='addr')
-		parser.add_argument('--user', '-u', dest='user')
-		parser.add_argument('--pass', '-P', dest='pw')
-		args = parser.parse_args()
-
-		# print(args)
-
-		if args.addr is not None:
-			self._ip = args.addr
-		if args.port is not None:
-			self._port = args.port
-		if args.user is not None and args.pw is not None:
-			self._auth = (args.user, args.pw)
-
-		pass
-
-	def sendRequest(self, function, data=None):
-		url = 'http://' + self._ip + ':' + self._port + function
-
-		debugDump('POST: ' + url, data)
-		resp = requests.post(url=url, json=data, auth=self._auth)
-
-		# gracefully add 401 error
-		if resp.status_code == 401:
-			return {'retval': False}
-
-		debugDump('RESP', resp.json())
-		return resp.json()
-
+# rstool subcommand whose output is sent
+# program = 'ipoverview'
+program = 'discoverview'
 
 class rsChat:
 	def __init__(self, rs, name):
@@ -103,13 +59,22 @@ class rsChat:
 		return html.escape(msg)
 		# return msg
 
-if __name__ == "__main__":
+def main():
 	rs = rsHost()
 	chat = rsChat(rs, lobbyName)
-	output = check_output([program])
-	output = output.decode("utf-8") 
+
+	# run the report in this interpreter and capture what it prints
+	import rstool
+	output = io.StringIO()
+	with contextlib.redirect_stdout(output):
+		rstool.run(program, sys.argv[1:])
+	output = output.getvalue()
 
 	# print(output)
 
 	output = '[sending from python]:\n' + output
 	chat.send(output)
+
+
+if __name__ == "__main__":
+	main()
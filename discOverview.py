@@ -1,100 +1,266 @@
 #!/usr/bin/env python3
 
-import json, requests, re, argparse
-from git import Repo
-
-debug = False
+import json, time, bisect, hashlib, asyncio, argparse
+from rsApi import rsHostAsync
+from rsFriends import rsFriendSnapshot, fetch_friend_snapshot
+from rsVersion import parseVersion, versionPattern
+from rsStats import record
+from rsState import rsStateFile
 
 repoPath = '~/Projects/RetroShare'
-
-def debugDump(label, data):
-	if not debug: return
-	print(label, json.dumps(data, sort_keys=True, indent=4))
-
-class rsHost:
-	_ip = '127.0.0.1'
-	_port = '9092'
-	_auth = ('test', 'tset')
-
-	def __init__(self):
-		parser = argparse.ArgumentParser(description='reads standard RS json API parameters.')
-		parser.add_argument('--port', '-p', help='json api port')
-		parser.add_argument('--addr', '-a', help='json api address')
-		parser.add_argument('--user', '-u', help='json api user')
-		parser.add_argument('--pass', '-P', help='json api password', dest='pw')
-		args, _ = parser.parse_known_args()
-
-		# print(args)
-
-		if args.addr is not None:
-			self._ip = args.addr
-		if args.port is not None:
-			self._port = args.port
-		if args.user is not None and args.pw is not None:
-			self._auth = (args.user, args.pw)
-
-		pass
-
-	def sendRequest(self, function, data=None):
-		url = 'http://' + self._ip + ':' + self._port + function
-
-		debugDump('POST: ' + url, data)
-		resp = requests.post(url=url, json=data, auth=self._auth)
-
-		# gracefully add 401 error
-		if resp.status_code == 401:
-			return {'retval': False}
-
-		debugDump('RESP', resp.json())
-		return resp.json()
-
+# builds are compared against this ref, e.g. 'RetroShare/master' for a remote
+masterRef = 'master'
+# nearest tag of every commit, rebuilt / extended when the repo changes
+indexPath = '~/.discOverview.index.json'
+# last known version of every friend, only asked again after they connected
+versionsPath = '~/.discOverview.versions.json'
+fullReconcile = 24 # hours
 
 class dataStruct:
-	def __init__(self, gitHash: str, tag: str, tagIsLatest: bool, rev: int, valid: bool, number: int):
+	def __init__(self, gitHash: str, tag: str, tagIsLatest: bool, rev: int, valid: bool, number: int, behind: int = None):
 		self.gitHash = gitHash
 		self.tag = tag
 		self.tagIsLatest = tagIsLatest
 		self.rev = rev
 		self.valid = valid
 		self.number = number
+		# commits behind master, -1 on a side branch, None if unknown
+		self.behind = behind
 
 	def getData(self) -> tuple:
 		return (self.gitHash, self.tag, self.tagIsLatest, self.rev, self.valid, self.number)
 
 
 
+class rsCommitIndex(rsStateFile):
+	# commit -> (nearest tag, commits since the tag), one walk over the history instead of a `git describe` per hash.
+	# Like git describe, the distance is the number of commits reachable from the commit but not from the tag,
+	# i.e. the difference of their ancestor counts, and the nearest tag is the one with the most ancestors.
+	fields = ['tags', 'tagCounts', 'commits', 'tips', 'tagKey']
+
+	def __init__(self, repo, path: str):
+		super().__init__(path)
+		self.repo = repo
+		# tag names, referenced by index from commits, and the ancestor count of their commit
+		self.tags = []
+		self.tagCounts = []
+		# sha -> [tag index or -1 without a tag, distance, ancestor count (including itself), generation, *parents]
+		# the generation is 1 for root commits, else 1 + the highest generation of the parents
+		self.commits = {}
+		# ref tips and tags the index was built from
+		self.tips = []
+		self.tagKey = None
+		# abbreviated hash -> sha (None when unknown or ambiguous)
+		self.prefixes = {}
+		self._sorted = None
+
+		self.load()
+		self.update()
+
+	def tagMap(self) -> dict:
+		# commit sha -> tag name, annotated tags win over lightweight ones on the same commit
+		from git import GitCommandError
+		try:
+			out = self.repo.git.show_ref('--tags', '-d')
+		except GitCommandError:
+			# no tags at all
+			return {}
+		tags = {}
+		for entry in out.splitlines():
+			sha, ref = entry.split(' ', 1)
+			name = ref[len('refs/tags/'):]
+			if name.endswith('^{}'):
+				tags[sha] = name[:-3]
+			else:
+				tags.setdefault(sha, name)
+		return tags
+
+	def update(self):
+		from git import GitCommandError
+		tips = sorted(set(self.repo.git.for_each_ref('--format=%(objectname)').split()))
+		tags = self.tagMap()
+		tagKey = hashlib.sha1(json.dumps(sorted(tags.items())).encode()).hexdigest()
+		if tips == self.tips and tagKey == self.tagKey:
+			return
+
+		args = ['--topo-order', '--reverse', '--parents', '--all']
+		out = None
+		if self.commits and tagKey == self.tagKey:
+			# only walk the new commits, their parents are known already
+			try:
+				out = self.repo.git.rev_list(*args, '--not', *self.tips)
+			except GitCommandError:
+				# old tips are gone (rewritten history)
+				pass
+		full = out is None
+		if full:
+			# new tags change the distance of everything after them
+			self.tags = []
+			self.tagCounts = []
+			self.commits = {}
+			out = self.repo.git.rev_list(*args)
+
+		self.walk(out, tags, full)
+		self.tips = tips
+		self.tagKey = tagKey
+		self.prefixes = {}
+		self._sorted = None
+		self.save()
+
+	def walk(self, revList: str, tags: dict, full: bool):
+		# rev-list lists every commit after its parents: "sha parent1 parent2 ..."
+		entries = [entry.split() for entry in revList.splitlines()]
+		tagIds = {name: n for n, name in enumerate(self.tags)}
+
+		# a full walk counts the ancestors of merges with one bitset per commit,
+		# kept until all of its children are done
+		ancestors = {}
+		children = {}
+		if full:
+			for sha, *parents in entries:
+				for parent in parents:
+					children[parent] = children.get(parent, 0) + 1
+
+		for bit, (sha, *parents) in enumerate(entries):
+			known = [self.commits[parent] for parent in parents if parent in self.commits]
+
+			if full:
+				mask = 1 << bit
+				for parent in parents:
+					mask |= ancestors.get(parent, 0)
+					children[parent] -= 1
+					if not children[parent]:
+						ancestors.pop(parent, None)
+				if children.get(sha):
+					ancestors[sha] = mask
+			if len(parents) > 1:
+				count = bin(mask).count('1') if full else int(self.repo.git.rev_list('--count', sha))
+			else:
+				count = known[0][2] + 1 if known else 1
+
+			if sha in tags:
+				name = tags[sha]
+				if name not in tagIds:
+					tagIds[name] = len(self.tags)
+					self.tags.append(name)
+					self.tagCounts.append(count)
+				tag = tagIds[name]
+			else:
+				candidates = [k[0] for k in known if k[0] != -1]
+				tag = max(candidates, key=lambda t: self.tagCounts[t]) if candidates else -1
+
+			generation = 1 + max([k[3] for k in known], default=0)
+			self.commits[sha] = [tag, count - self.tagCounts[tag] if tag != -1 else 0, count, generation, *parents]
+
+	def resolve(self, hash: str):
+		hash = hash.lower()
+		if hash in self.commits:
+			return hash
+		if hash not in self.prefixes:
+			if self._sorted is None:
+				self._sorted = sorted(self.commits)
+			n = bisect.bisect_left(self._sorted, hash)
+			matches = [sha for sha in self._sorted[n:n + 2] if sha.startswith(hash)]
+			self.prefixes[hash] = matches[0] if len(matches) == 1 else None
+		return self.prefixes[hash]
+
+	def lookup(self, hash: str):
+		# (tag, distance) of a full or abbreviated hash, None if it is unknown, ambiguous or not after any tag
+		sha = self.resolve(hash)
+		if sha is None:
+			return None
+		tag, distance = self.commits[sha][:2]
+		if tag == -1:
+			return None
+		return self.tags[tag], distance
+
+	def behind(self, hashes: list, ref: str) -> dict:
+		# hash -> commits the ref is ahead of it, -1 if the ref doesn't contain it (side branch), None if unknown.
+		# One walk from the ref for all hashes, never below the lowest generation asked for.
+		from git import GitCommandError
+		try:
+			tip = self.repo.git.rev_parse(ref + '^{commit}')
+		except GitCommandError:
+			tip = None
+		shas = {hash: self.resolve(hash) for hash in hashes}
+		if tip not in self.commits:
+			return {hash: None for hash in hashes}
+
+		wanted = [sha for sha in shas.values() if sha is not None]
+		lowest = min([self.commits[sha][3] for sha in wanted], default=self.commits[tip][3])
+		reachable = set()
+		stack = [tip]
+		while stack:
+			sha = stack.pop()
+			if sha in reachable or sha not in self.commits:
+				continue
+			reachable.add(sha)
+			entry = self.commits[sha]
+			if entry[3] > lowest:
+				stack.extend(entry[4:])
+
+		# the ref's ancestors are a superset of the commit's -> the difference of the counts is exact
+		count = self.commits[tip][2]
+		return {hash: None if sha is None else count - self.commits[sha][2] if sha in reachable else -1 for hash, sha in shas.items()}
+
+
 class rsGit:
 	# v0.6.4-481-gfe5e83125
 	regEx = '(.+-?.+)-(.+)-(.+)'
 	def __init__(self):
+		# GitPython is slow to import, only load it when needed
+		from git import Repo
 		self.git = Repo(repoPath)
 		#self.git.git.checkout('RetroShare/master')
 
-		t = self.git.git.describe('--tags')
-		match = re.search(self.regEx, t)
+		self.index = rsCommitIndex(self.git, indexPath)
+		head = self.index.lookup(self.git.head.commit.hexsha)
+		# v0.6.5-RC1
+		self.tag = head[0] if head is not None else ''
 
-		if match is not None:
-			self.tag = match.group(1)
-		else:
-			# v0.6.5-RC1
-			self.tag = t
+	def getBehind(self, hashes: list) -> dict:
+		return self.index.behind(hashes, masterRef)
 
 	def getCommitNum(self, hash: str):
-		try:
-			t = self.git.git.describe('--tags', hash)
-		except:
-			return False, False, '', ''
-		match = re.search(self.regEx, t)
-		if match == None:
+		found = self.index.lookup(hash)
+		if found is None:
 			return False, False, '', ''
 
-		# get number of commits		
-		num = match.group(2)
+		# get last tag and number of commits
+		tag, num = found
+
+		return True, tag == self.tag, tag, str(num)
+
 
-		# get last tag
-		tag = match.group(1)
+class rsVersionCache(rsStateFile):
+	fields = ['peers', 'lastFull']
 
-		return True, tag == self.tag, tag, num
+	def __init__(self, path: str):
+		super().__init__(path)
+		# sslId -> [version string (None when RS had none), lastConnect when it was fetched]
+		self.peers = {}
+		self.lastFull = 0
+		self.load()
+
+	def needsFull(self, now: float) -> bool:
+		return not self.peers or now - self.lastFull > fullReconcile * 3600
+
+	def prune(self, friends: list):
+		current = set(friends)
+		self.peers = {sslId: entry for sslId, entry in self.peers.items() if sslId in current}
+
+	def stale(self, friends: list, lastConnect) -> list:
+		# new friends and those that connected again after their version was fetched
+		# (a version only changes with a restart, which means reconnecting)
+		return [sslId for sslId in friends if sslId not in self.peers or lastConnect(sslId) > self.peers[sslId][1]]
+
+	def store(self, sslIds: list, responses: list, lastConnect):
+		for sslId, resp in zip(sslIds, responses):
+			self.peers[sslId] = [resp['version'] if resp.get('retval') else None, lastConnect(sslId)]
+
+	def responses(self, friends: list) -> list:
+		# what getPeerVersion answered
+		return [{'retval': self.peers[sslId][0] is not None, 'version': self.peers[sslId][0] or ''} for sslId in friends]
 
 
 def addUnknown(data, entry):
@@ -107,61 +273,57 @@ def line():
 	print('-' * 50)
 
 
-if __name__ == "__main__":
-	rs = rsHost()
+def run(ars: rsHostAsync, snap: rsFriendSnapshot = None, full: bool = False):
+	rs = ars.rs
 	repo = rsGit()
+	now = time.time()
+
+	cache = rsVersionCache(versionsPath)
+	full = full or cache.needsFull(now)
 
-	friends = rs.sendRequest('/rsPeers/getFriendList')['sslIds']
+	if snap is None:
+		friends = list(dict.fromkeys(rs.sendRequest('/rsPeers/getFriendList')['sslIds']))
+		cache.prune(friends)
+		if full:
+			candidates = friends
+		else:
+			# without a snapshot only new friends and those connected right now can have reconnected,
+			# the ones that came and went between two runs are caught by the periodic full refresh
+			online = set(rs.sendRequest('/rsPeers/getOnlineList')['sslIds'])
+			candidates = [sslId for sslId in friends if sslId not in cache.peers or sslId in online]
+		details = fetch_friend_snapshot(ars, candidates).details
+	else:
+		friends = snap.sslIds()
+		cache.prune(friends)
+		details = snap.details
+	lastConnect = lambda sslId: details[sslId]['lastConnect'] if sslId in details else 0
+
+	update = friends if full else cache.stale(friends, lastConnect)
+	print('asking ' + str(len(update)) + ' of ' + str(len(friends)) + ' friends for their version' + (' (full)' if full else ''))
+
+	# fetch the versions concurrently
+	cache.store(update, asyncio.run(ars.gather('/rsGossipDiscovery/getPeerVersion', [{'id': friend} for friend in update])), lastConnect)
+	if full:
+		cache.lastFull = now
+	cache.save()
+	allVersions = cache.responses(friends)
 	gits = {}
 	versions = {}
 	versionUnknown = {}
 	entries = 0
 
-	for friend in friends:
-		req = {'id': friend}
-		resp = rs.sendRequest('/rsGossipDiscovery/getPeerVersion', req)
-
+	for resp in allVersions:
 		if not resp['retval']:
 			continue
 		versionStr = resp['version']
 		#print(versionStr)
 
-		# 0.6.4 Revision 90393419
-		match = re.search('(.*)\sRevision\s([a-f0-9]+)', versionStr)
-		if match == None:
-			# 0.6.4-524-gb51b1fc8c
-			match = re.search(rsGit.regEx, versionStr)
-			if match == None:
-				addUnknown(versionUnknown, versionStr)
-				continue
-			version = match.group(1)
-			if match.group(3)[0] == 'g':
-				git = match.group(3)[1:]
-			else:
-				# 0.6.9999-208-g62ab99fc4-OBS
-				if match.group(2)[0] == 'g':
-					git = match.group(2)[1:]
-				else:
-					addUnknown(versionUnknown, versionStr)
-					continue
-		else:
-			version = match.group(1)
-			git = match.group(2)
-
-		# some sanuity checks
-		#print(version, git)
-		if len(git) < 5:
-			#print('git hash too short', git)
+		parsed = parseVersion(versionStr)
+		if parsed is None:
 			addUnknown(versionUnknown, versionStr)
 			continue
-		try:
-			# this is supposed to be a hexadecimal string
-			int('0x' + git, 16)
-		except ValueError:
-			#print('invalid git hash', git)
-			addUnknown(versionUnknown, versionStr)
-			continue
-		
+		version, git = parsed
+
 		if version in versions:
 			versions[version] = versions[version] + 1			
 		else:
@@ -179,9 +341,10 @@ if __name__ == "__main__":
 	future  = 0
 	# collect information from git (for later sorting)
 	dataSet = []
+	behind = repo.getBehind(list(gits))
 	for hash, number in gits.items():
 		valid, tagLatest, tag, rev = repo.getCommitNum(hash)
-		dataSet.append(dataStruct(hash, tag, tagLatest, rev, valid, number))
+		dataSet.append(dataStruct(hash, tag, tagLatest, rev, valid, number, behind[hash]))
 	#print([x.getData() for x in dataSet])
 
 	# old sorting
@@ -196,13 +359,25 @@ if __name__ == "__main__":
 		print('{:24}times seen: {}'.format(version, number))
 	line()
 
-	# sort approximately to publish/commit date
-	sorter = lambda x: (x.valid, x.tagIsLatest, x.tag ,int(x.rev) if x.valid else -1)
+	# unknown, side branches, then by how far behind master (most urgent upgrade first)
+	sorter = lambda x: (x.behind is not None, x.behind != -1, -(x.behind or 0), x.valid, x.tagIsLatest, x.tag, int(x.rev) if x.valid else -1)
+	# unknown, side branch, up to date, behind
+	ancestry = [0, 0, 0, 0]
 	for d in sorted(dataSet, key=sorter):
 		# get data
 		hash, tag, tagLatest, rev, valid, number = d.getData()
 
-		print('{:12}{:12}times seen: {!s:3} {}'.format(hash, (('rev: ' + rev) if valid else '~invalid~'), number, ('' if tagLatest or not valid else ('(' + tag + ')'))))
+		if d.behind is None:
+			state = 'unknown'
+			ancestry[0] += number
+		elif d.behind == -1:
+			state = 'side branch'
+			ancestry[1] += number
+		else:
+			state = str(d.behind) + ' behind'
+			ancestry[2 if d.behind == 0 else 3] += number
+
+		print('{:12}{:12}{:14}times seen: {!s:3} {}'.format(hash, (('rev: ' + rev) if valid else '~invalid~'), state, number, ('' if tagLatest or not valid else ('(' + tag + ')'))))
 
 		# count how many are newer/older than the latest (official release)
 		if '01234567' in hash:
@@ -223,6 +398,48 @@ if __name__ == "__main__":
 	print('(excluding invalids, counting "01234567" as newer)')
 	line()
 
+	print('{:33}{}'.format('up to date with ' + masterRef + ':', ancestry[2]))
+	print('{:33}{}'.format('behind ' + masterRef + ':', ancestry[3]))
+	print('{:33}{}'.format('on a side branch:', ancestry[1]))
+	print('{:33}{}'.format('unknown commit:', ancestry[0]))
+	line()
+
 	print('The following version strings are not understand:')
 	for v in versionUnknown:
 		print('{:12} time(s) {!s}'.format(versionUnknown[v], v))
+	line()
+
+	# the same by format, to spot new kinds of builds
+	patterns = {}
+	for v, number in versionUnknown.items():
+		pattern = versionPattern(v)
+		patterns[pattern] = patterns.get(pattern, 0) + number
+	print('by format:')
+	for pattern, number in sorted(patterns.items(), key=lambda x: -x[1]):
+		print('{:12} time(s) {}'.format(number, pattern))
+
+	# keep the numbers for ./rstool.py stats
+	stats = {
+		'entries': entries,
+		'unknown': sum(versionUnknown.values()),
+		'olderThanRelease': past,
+		'newerThanRelease': future,
+		'upToDate': ancestry[2],
+		'behind': ancestry[3],
+		'sideBranch': ancestry[1],
+	}
+	stats.update({'version:' + version: number for version, number in versions.items()})
+	stats.update({'hash:' + hash: number for hash, number in gits.items()})
+	record('discoverview', stats)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='shows the RetroShare versions used by friends')
+	parser.add_argument('--full', help='ask all friends for their version, not only those that connected since the last run', action='store_true')
+	args, _ = parser.parse_known_args()
+
+	run(rsHostAsync(), full=args.full)
+
+
+if __name__ == "__main__":
+	main()
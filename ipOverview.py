@@ -1,56 +1,13 @@
 #!/usr/bin/env python3
 
-import json, requests, re, argparse
+import re
+from rsApi import rsHostAsync
+from rsFriends import rsFriendSnapshot, fetch_friend_snapshot
+from rsStats import record
 
-debug = False
-
-def debugDump(label, data):
-	if not debug: return
-	print(label, json.dumps(data, sort_keys=True, indent=4))
-
-class rsHost:
-	# some defaults
-	_ip = '127.0.0.1'
-	_port = '9092'
-	_auth = ('test', 'tset')
-
-	def __init__(self):
-		parser = argparse.ArgumentParser(description='reads standard RS json API parameters.')
-		parser.add_argument('--port', '-p', help='json api port')
-		parser.add_argument('--addr', '-a', help='json api address')
-		parser.add_argument('--user', '-u', help='json api user')
-		parser.add_argument('--pass', '-P', help='json api password', dest='pw')
-		args, _ = parser.parse_known_args()
-
-		# print(args)
-
-		if args.addr is not None:
-			self._ip = args.addr
-		if args.port is not None:
-			self._port = args.port
-		if args.user is not None and args.pw is not None:
-			self._auth = (args.user, args.pw)
-
-		pass
-
-	def sendRequest(self, function, data=None):
-		url = 'http://' + self._ip + ':' + self._port + function
-
-		debugDump('POST: ' + url, data)
-		resp = requests.post(url=url, json=data, auth=self._auth)
-
-		# gracefully add 401 error
-		if resp.status_code == 401:
-			return {'retval': False}
-
-		debugDump('RESP', resp.json())
-		return resp.json()
-
-
-if __name__ == "__main__":
-	rs = rsHost()
-
-	friends = rs.sendRequest('/rsPeers/getFriendList')['sslIds']
+def run(ars: rsHostAsync, snap: rsFriendSnapshot = None):
+	if snap is None:
+		snap = fetch_friend_snapshot(ars)
 
 	# IPv4
 	v4 = 0
@@ -82,9 +39,7 @@ if __name__ == "__main__":
 	udpi = 0
 	udpo = 0
 
-	for friend in friends:
-		req = {'sslId': friend}
-		details = rs.sendRequest('/rsPeers/getPeerDetails', req)['det']
+	for details in snap.details.values():
 
 		ser = 1 if details['actAsServer'] else 0
 
@@ -166,3 +121,23 @@ if __name__ == "__main__":
 	print('TCP/UDP (excluding Tor/I2P):')
 	printStat2('TCP', tcpi + tcpo, tcpi, tcpo)
 	printStat2('UDP', udpi + udpo, udpi, udpo)
+
+	# keep the numbers for ./rstool.py stats
+	stats = {}
+	for name, all, connected, num_in, num_out in [
+			('ipv4', v4, v4c, v4i, v4o), ('ipv6', v6, v6c, v6i, v6o), ('tor', t, tc, ti, to), ('i2p', i, ic, ii, io),
+			('tcp', None, tcpi + tcpo, tcpi, tcpo), ('udp', None, udpi + udpo, udpi, udpo)]:
+		if all is not None:
+			stats[name] = all
+		stats[name + '.connected'] = connected
+		stats[name + '.in'] = num_in
+		stats[name + '.out'] = num_out
+	record('ipoverview', stats)
+
+
+def main():
+	run(rsHostAsync())
+
+
+if __name__ == "__main__":
+	main()
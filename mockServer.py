@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+
+# stand-in for the RetroShare json api, backed by a synthetic network
+#
+#   ./mockServer.py --friends 10000 --latency 5 &
+#   time ./ipOverview.py --port 9092
+
+import json, argparse, base64, random, time, threading, queue, socket
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+services = [
+	'disc', 'chat', 'msg', 'turtle', 'heartbeat', 'ft', 'Global Router', 'file_database', 'serviceinfo',
+	'bandwidth_ctrl', 'GxsTunnels', 'banlist', 'status', 'gxsid', 'gxsforums', 'gxsposted', 'gxschannels',
+	'gxscircle', 'gxsreputation', 'GXS Mails', 'rtt',
+]
+
+versions = [
+	'0.6.4 Revision 90393419',
+	'0.6.5-RC1',
+	'v0.6.4-481-gfe5e83125',
+	'v0.6.5-12-g62ab99fc4',
+	'v0.6.5-208-g62ab99fc4-OBS',
+	'v0.6.6-33-gb51b1fc8c',
+	'v0.6.6-104-g0123456789',
+	'unknown',
+]
+
+names = ['alice', 'bob', 'carol', 'dave', 'eve', 'frank', 'grace', 'heidi', 'ivan', 'judy', 'mallory', 'test']
+
+day = 24 * 3600
+
+
+class rsMockNetwork:
+	def __init__(self, friends: int = 100, lobbies: int = 10, seed: int = 0):
+		self.rand = random.Random(seed)
+		self.lock = threading.Lock()
+		now = int(time.time())
+
+		# pgp ids, some of them with several locations
+		self.peers = {}
+		pgpIds = []
+		for n in range(friends):
+			if not pgpIds or self.rand.random() < 0.7:
+				pgpIds.append(self._hex(16))
+			gpgId = self.rand.choice(pgpIds)
+			sslId = self._hex(32)
+			self.peers[sslId] = self._peer(sslId, gpgId, now)
+
+		self.groups = {}
+		self._nextGroupId = 1
+		self.addGroup({'name': 'Friends', 'flag': 0, 'peerIds': []})
+
+		self.services = {}
+		for n, name in enumerate(services):
+			id = 0x02000000 + (n + 1) * 0x100
+			self.services[id] = {
+				'mServiceName': name,
+				'mServiceType': id,
+				'mVersionMajor': 1,
+				'mVersionMinor': 0,
+				'mMinVersionMajor': 1,
+				'mMinVersionMinor': 0,
+			}
+		self.permissions = {}
+		for id, info in self.services.items():
+			self.permissions[id] = {
+				'mServiceId': id,
+				'mServiceName': info['mServiceName'],
+				'mDefaultAllowed': True,
+				'mPeersAllowed': [],
+				'mPeersDenied': [],
+			}
+
+		self.lobbies = {}
+		for n in range(lobbies):
+			id = self.rand.getrandbits(63)
+			self.lobbies[id] = {
+				'lobby_id': xint64(id),
+				'lobby_name': 'Retroshare Devel (signed)' if n == 0 else 'lobby ' + str(n),
+				'lobby_topic': '',
+				'participating_friends': [],
+				'gxs_id': self._hex(32),
+				'lobby_flags': 0,
+				'gxs_ids': [],
+				'last_activity': now,
+			}
+
+		# event subscribers (one queue per sse stream)
+		self.subscribers = []
+
+	def _hex(self, length: int) -> str:
+		return '%0*x' % (length, self.rand.getrandbits(length * 4))
+
+	def _peer(self, sslId: str, gpgId: str, now: int) -> dict:
+		hidden = self.rand.random() < 0.1
+		online = self.rand.random() < 0.2
+		# mostly recent, with a long tail of dead peers
+		lastConnect = now if online else now - int(self.rand.expovariate(1 / (20 * day)))
+		server = self.rand.random() < 0.5
+
+		if hidden:
+			if self.rand.random() < 0.8:
+				hiddenAddr = self._hex(16) + '.onion'
+			else:
+				hiddenAddr = self._hex(26) + '.b32.i2p'
+			ips = []
+			connectAddr = '127.0.0.1' if online else ''
+			connectState = 6 if online else 0
+		else:
+			hiddenAddr = ''
+			v4 = '.'.join(str(self.rand.randrange(1, 255)) for i in range(4))
+			ips = ['ipv4://' + v4 + ':' + str(self.rand.randrange(1024, 65535))]
+			if self.rand.random() < 0.3:
+				ips.append('ipv6://[2001:db8::' + self._hex(4) + ']:' + str(self.rand.randrange(1024, 65535)))
+			connectAddr = v4 if online else ''
+			connectState = self.rand.choice([4, 5]) if online else 0
+
+		return {
+			'id': sslId,
+			'gpg_id': gpgId,
+			# the name belongs to the pgp key, all locations share it
+			'name': names[int(gpgId, 16) % len(names)] + '-' + gpgId[:4],
+			'location': 'location-' + sslId[:4],
+			'isHiddenNode': hidden,
+			'hiddenNodeAddress': hiddenAddr,
+			'hiddenNodePort': 0,
+			'actAsServer': server,
+			'connectAddr': connectAddr,
+			'connectPort': 0,
+			'connectState': connectState,
+			'ipAddressList': ips,
+			'lastConnect': lastConnect,
+			'state': 4 if online else 0,
+			'version': self.rand.choice(versions),
+		}
+
+	def addGroup(self, info: dict) -> dict:
+		with self.lock:
+			id = '%032x' % self._nextGroupId
+			self._nextGroupId += 1
+			group = {'id': id, 'name': info['name'], 'flag': info.get('flag', 0), 'peerIds': list(info.get('peerIds', []))}
+			self.groups[id] = group
+			return group
+
+	def groupByName(self, name: str):
+		for group in self.groups.values():
+			if group['name'] == name:
+				return group
+		return None
+
+	def publish(self, event: dict):
+		for subscriber in list(self.subscribers):
+			subscriber.put(event)
+
+	def connectRandomPeer(self):
+		with self.lock:
+			sslId = self.rand.choice(list(self.peers))
+			self.peers[sslId]['lastConnect'] = int(time.time())
+		# RsConnectionEvent, PEER_CONNECTED
+		self.publish({'mType': 4, 'mSslId': sslId, 'mConnectionInfoCode': 1})
+
+
+class rsMockHandler(BaseHTTPRequestHandler):
+	# keep-alive, like the real daemon
+	protocol_version = 'HTTP/1.1'
+
+	def setup(self):
+		super().setup()
+		# headers and body are written separately -> don't let nagle delay the body
+		self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+	def log_message(self, format, *args):
+		pass
+
+	def do_GET(self):
+		self.do_POST()
+
+	def do_POST(self):
+		length = int(self.headers.get('Content-Length', 0))
+		body = self.rfile.read(length) if length else b''
+
+		if not self._authorized():
+			self._send(401, b'')
+			return
+
+		try:
+			data = json.loads(body) if body else {}
+		except ValueError:
+			self._send(400, b'')
+			return
+
+		if self.path == '/rsEvents/registerEventsHandler':
+			self._stream(data)
+			return
+
+		handler = self.server.endpoints.get(self.path)
+		if handler is None:
+			self._send(404, b'')
+			return
+
+		latency = self.server.latency + self.server.jitter * self.server.network.rand.random()
+		if latency > 0:
+			time.sleep(latency)
+
+		resp = handler(self.server.network, data or {})
+		self._send(200, json.dumps(resp).encode())
+
+	def _authorized(self) -> bool:
+		auth = self.headers.get('Authorization', '')
+		if not auth.startswith('Basic '):
+			return False
+		return base64.b64decode(auth[6:]).decode() == self.server.user + ':' + self.server.pw
+
+	def _send(self, code: int, body: bytes):
+		self.send_response(code)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def _stream(self, data: dict):
+		eventType = data.get('eventType', 0)
+		events = queue.Queue()
+		self.server.network.subscribers.append(events)
+
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/event-stream')
+		self.send_header('Connection', 'close')
+		self.end_headers()
+		self.close_connection = True
+		try:
+			self._event({'retval': True})
+			while True:
+				event = events.get()
+				if eventType == 0 or event['mType'] == eventType:
+					self._event({'event': event})
+		except (BrokenPipeError, ConnectionResetError):
+			pass
+		finally:
+			self.server.network.subscribers.remove(events)
+
+	def _event(self, data: dict):
+		self.wfile.write(b'data: ' + json.dumps(data).encode() + b'\n\n')
+		self.wfile.flush()
+
+
+# endpoints
+
+def getFriendList(net, data):
+	return {'retval': True, 'sslIds': list(net.peers)}
+
+def getOnlineList(net, data):
+	return {'retval': True, 'sslIds': [sslId for sslId, det in net.peers.items() if det['connectAddr'] != '']}
+
+def getPeerDetails(net, data):
+	det = net.peers.get(data.get('sslId'))
+	if det is None:
+		return {'retval': False}
+	det = dict(det)
+	del det['version']
+	return {'retval': True, 'det': det}
+
+def getPeerVersion(net, data):
+	det = net.peers.get(data.get('id'))
+	if det is None or det['version'] == 'unknown':
+		return {'retval': False, 'version': ''}
+	return {'retval': True, 'version': det['version']}
+
+def getGroupInfoList(net, data):
+	return {'retval': True, 'groupInfoList': list(net.groups.values())}
+
+def getGroupInfoByName(net, data):
+	group = net.groupByName(data.get('groupName'))
+	if group is None:
+		return {'retval': False}
+	return {'retval': True, 'groupInfo': group}
+
+def addGroup(net, data):
+	if net.groupByName(data['groupInfo']['name']) is not None:
+		return {'retval': False}
+	net.addGroup(data['groupInfo'])
+	return {'retval': True}
+
+def removeGroup(net, data):
+	return {'retval': net.groups.pop(data['groupInfo'].get('id'), None) is not None}
+
+def assignPeersToGroup(net, data):
+	group = net.groups.get(data.get('groupId'))
+	if group is None:
+		return {'retval': False}
+	with net.lock:
+		peerIds = set(group['peerIds'])
+		if data['assign']:
+			peerIds.update(data['peerIds'])
+		else:
+			peerIds.difference_update(data['peerIds'])
+		group['peerIds'] = sorted(peerIds)
+	return {'retval': True}
+
+def getOwnServices(net, data):
+	serviceList = [{'key': id, 'value': info} for id, info in net.services.items()]
+	return {'retval': True, 'info': {'mPeerId': '0' * 32, 'mServiceList': serviceList}}
+
+def getServicePermissions(net, data):
+	perms = net.permissions.get(data.get('serviceId'))
+	if perms is None:
+		return {'retval': False}
+	return {'retval': True, 'permissions': perms}
+
+def updateServicePermissions(net, data):
+	id = data.get('serviceId')
+	if id not in net.permissions:
+		return {'retval': False}
+	net.permissions[id] = data['permissions']
+	return {'retval': True}
+
+def xint64(n: int) -> dict:
+	# 64 bit ids don't survive javascript's doubles, RS sends them both ways
+	return {'xint64': n, 'xstr64': str(n)}
+
+def fromXint64(value) -> int:
+	# accepts what clients send: a number, a string or the object above
+	if isinstance(value, dict):
+		value = value.get('xstr64', value.get('xint64'))
+	try:
+		return int(value)
+	except (TypeError, ValueError):
+		return None
+
+def getChatLobbyList(net, data):
+	return {'retval': True, 'cl_list': [xint64(id) for id in net.lobbies]}
+
+def getChatLobbyInfo(net, data):
+	info = net.lobbies.get(fromXint64(data.get('id')))
+	if info is None:
+		return {'retval': False}
+	return {'retval': True, 'info': info}
+
+def sendChat(net, data):
+	# echo into the event stream (CHAT_MESSAGE), so a bot can be exercised without peers
+	chatId = dict(data['id'])
+	if 'lobby_id' in chatId:
+		chatId['lobby_id'] = xint64(fromXint64(chatId['lobby_id']))
+	msg = {
+		'chat_id': chatId,
+		'broadcast_peer_id': '0' * 32,
+		'lobby_peer_gxs_id': '0' * 32,
+		'peer_alternate_nickname': '',
+		'chatflags': 0,
+		'sendTime': int(time.time()),
+		'recvTime': int(time.time()),
+		'msg': data['msg'],
+		'incoming': False,
+		'online': True,
+	}
+	net.publish({'mType': 15, 'mChatMessage': msg})
+	return {'retval': True}
+
+def getIdDetails(net, data):
+	return {'retval': True, 'details': {'mId': data.get('id'), 'mNickname': 'nick-' + str(data.get('id'))[:4]}}
+
+def getDistantChatStatus(net, data):
+	return {'retval': True, 'info': {'to_id': data.get('pid'), 'own_id': '0' * 32, 'pending_id': '0' * 32, 'status': 2}}
+
+def attemptLogin(net, data):
+	return {'retval': 0}
+
+def rsGlobalShutDown(net, data):
+	return {'retval': True}
+
+
+endpoints = {
+	'/rsPeers/getFriendList': getFriendList,
+	'/rsPeers/getOnlineList': getOnlineList,
+	'/rsPeers/getPeerDetails': getPeerDetails,
+	'/rsGossipDiscovery/getPeerVersion': getPeerVersion,
+	'/rsPeers/getGroupInfoList': getGroupInfoList,
+	'/rsPeers/getGroupInfoByName': getGroupInfoByName,
+	'/rsPeers/addGroup': addGroup,
+	'/rsPeers/removeGroup': removeGroup,
+	'/rsPeers/assignPeersToGroup': assignPeersToGroup,
+	'/rsServiceControl/getOwnServices': getOwnServices,
+	'/rsServiceControl/getServicePermissions': getServicePermissions,
+	'/rsServiceControl/updateServicePermissions': updateServicePermissions,
+	'/rsMsgs/getChatLobbyList': getChatLobbyList,
+	'/rsMsgs/getChatLobbyInfo': getChatLobbyInfo,
+	'/rsMsgs/sendChat': sendChat,
+	'/rsMsgs/getDistantChatStatus': getDistantChatStatus,
+	'/rsIdentity/getIdDetails': getIdDetails,
+	'/rsLoginHelper/attemptLogin': attemptLogin,
+	'/rsControl/rsGlobalShutDown': rsGlobalShutDown,
+}
+
+
+class rsMockServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, addr: str = '127.0.0.1', port: int = 9092, network: rsMockNetwork = None,
+			latency: float = 0.0, jitter: float = 0.0, user: str = 'test', pw: str = 'tset'):
+		super().__init__((addr, port), rsMockHandler)
+		self.network = network if network is not None else rsMockNetwork()
+		self.endpoints = endpoints
+		# seconds
+		self.latency = latency
+		self.jitter = jitter
+		self.user = user
+		self.pw = pw
+
+	def startEvents(self, interval: float):
+		# let random peers connect now and then
+		def run():
+			while True:
+				time.sleep(interval)
+				self.network.connectRandomPeer()
+
+		threading.Thread(target=run, name='rsMockEvents', daemon=True).start()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='local stand-in for the RS json API')
+	parser.add_argument('--port', '-p', help='listen port', type=int, default=9092)
+	parser.add_argument('--addr', '-a', help='listen address', default='127.0.0.1')
+	parser.add_argument('--user', '-u', help='json api user', default='test')
+	parser.add_argument('--pass', '-P', help='json api password', dest='pw', default='tset')
+	parser.add_argument('--friends', '-n', help='number of friend locations', type=int, default=100)
+	parser.add_argument('--lobbies', help='number of chat lobbies', type=int, default=10)
+	parser.add_argument('--seed', help='seed of the synthetic network', type=int, default=0)
+	parser.add_argument('--latency', help='per request latency in ms', type=float, default=0.0)
+	parser.add_argument('--jitter', help='additional random latency in ms', type=float, default=0.0)
+	parser.add_argument('--event-interval', help='seconds between synthetic peer connection events', type=float, dest='eventInterval')
+	args = parser.parse_args()
+
+	network = rsMockNetwork(args.friends, args.lobbies, args.seed)
+	server = rsMockServer(args.addr, args.port, network, args.latency / 1000, args.jitter / 1000, args.user, args.pw)
+	if args.eventInterval:
+		server.startEvents(args.eventInterval)
+
+	print('serving ' + str(len(network.peers)) + ' friends on ' + args.addr + ':' + str(args.port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
@@ -1,48 +1,102 @@
 #!/usr/bin/env python3
 
-import json, requests
+# resets all service permissions, or saves / restores them
+#
+#   ./rstool.py resetperms --save perms.json
+#   ./rstool.py resetperms --restore perms.json
+#
+# only services that differ get updated, all of them at the same time.
 
-debug = False
+import json, time, asyncio, argparse
+from rsApi import rsHostAsync
+from autoPermissions import rsServicePerms, cleanPerms, permsDelta
 
-port = 9092
-user = 'test'
-pw = 'tset'
 
-def debugDump(label, data):
-	if not debug: return
-	print(label, json.dumps(data, sort_keys=True, indent=4))
+async def fetchAll(ars: rsHostAsync, perms: rsServicePerms) -> dict:
+	# serviceId -> permissions
+	ids = list(perms.services)
+	responses = await ars.gather('/rsServiceControl/getServicePermissions', [{'serviceId': id} for id in ids])
+	return {id: resp['permissions'] for id, resp in zip(ids, responses) if resp.get('retval')}
 
-def sendRequest(function, data = None):
-	url = 'http://127.0.0.1:' + str(port) + function
 
-	debugDump('POST: ' + url, data)
-	resp = requests.post(url=url, json=data, auth=(user, pw))
+async def updateAll(ars: rsHostAsync, perms: rsServicePerms, current: dict, desired: dict, dryRun: bool = False) -> int:
+	# only send what differs
+	update = []
+	for id, p in desired.items():
+		delta = permsDelta(current[id], p)
+		if not delta:
+			continue
+		print(perms.services[id]['mServiceName'] + ': ' + ', '.join(delta))
+		update.append({'serviceId': id, 'permissions': p})
 
-	# gracefully add 401 error
-	if resp.status_code == 401:
-		return {'retval': False}
+	if not dryRun:
+		await ars.gather('/rsServiceControl/updateServicePermissions', update)
+	return len(update)
 
-	debugDump('RESP', resp.json())
-	return resp.json()
 
+def save(path: str, perms: rsServicePerms, current: dict):
+	# keyed by name, the ids are not guaranteed to survive an update of RS
+	data = {
+		'time': int(time.time()),
+		'services': {perms.services[id]['mServiceName']: p for id, p in current.items()},
+	}
+	with open(path, 'w') as f:
+		json.dump(data, f, separators=(',', ':'))
+	print('saved ' + str(len(current)) + ' services to ' + path)
 
 
-if __name__ == "__main__":
-	resp = sendRequest('/rsServiceControl/getOwnServices')
-	for service in resp['info']['mServiceList']:
-		name = service["value"]["mServiceName"]
-		id = service["key"]
-
-		req = {'serviceId': id}
-		resp = sendRequest('/rsServiceControl/getServicePermissions', req)
-		if not resp['retval']:
+def load(path: str, perms: rsServicePerms, current: dict) -> dict:
+	with open(path) as f:
+		data = json.load(f)
+
+	desired = {}
+	for name, p in data['services'].items():
+		id = perms.getId(name)
+		if id == -1 or id not in current:
+			print('skipping unknown service ' + name)
 			continue
+		p = cleanPerms(p)
+		# the saved record still carries the id and name of the service when it was saved
+		p['mServiceId'] = id
+		p['mServiceName'] = name
+		desired[id] = p
+	return desired
 
-		p = resp['permissions']
+
+def reset(current: dict) -> dict:
+	desired = {}
+	for id, p in current.items():
+		p = cleanPerms(p)
 		p['mDefaultAllowed'] = True
 		p['mPeersDenied'].clear()
 		p['mPeersAllowed'].clear()
+		desired[id] = p
+	return desired
+
+
+def main():
+	parser = argparse.ArgumentParser(description='resets all service permissions to allow everyone, or saves / restores them')
+	parser.add_argument('--save', help='write all service permissions to this file and change nothing')
+	parser.add_argument('--restore', help='set all service permissions to the ones saved in this file')
+	parser.add_argument('--dry-run', help='only print what would change', action='store_true', dest='dryRun')
+	args, _ = parser.parse_known_args()
 
-		# update req
-		req['permissions'] = p
-		sendRequest('/rsServiceControl/updateServicePermissions', req)
+	ars = rsHostAsync()
+	perms = rsServicePerms(ars.rs)
+	current = asyncio.run(fetchAll(ars, perms))
+
+	if args.save:
+		save(args.save, perms, current)
+		return
+
+	desired = load(args.restore, perms, current) if args.restore else reset(current)
+	changed = asyncio.run(updateAll(ars, perms, current, desired, args.dryRun))
+	if args.dryRun:
+		action = 'would restore ' if args.restore else 'would reset '
+	else:
+		action = 'restored ' if args.restore else 'reset '
+	print(action + str(changed) + ' of ' + str(len(desired)) + ' services')
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+
+import json, argparse, threading, time, atexit, random
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from rsCache import rsResponseCache
+from rsMetrics import rsMetrics
+from rsDecode import decode, iterArray
+
+debug = False
+
+def debugDump(label, data):
+	if not debug: return
+	print(label, json.dumps(data, sort_keys=True, indent=4))
+
+def isReadOnly(function: str) -> bool:
+	# getters can safely be sent more than once
+	name = function[function.rfind('/') + 1:]
+	return name.startswith(('get', 'is', 'has'))
+
+
+class rsApiError(Exception):
+	pass
+
+
+class rsDeadlineExceeded(rsApiError):
+	# the caller's own deadline ran out, which says nothing about the daemon's health
+	pass
+
+
+class rsCircuitBreaker:
+	def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+		# consecutive failures before failing fast for cooldown seconds
+		self.threshold = threshold
+		self.cooldown = cooldown
+		self.failures = 0
+		self.openUntil = 0.0
+		self._lock = threading.Lock()
+
+	def allow(self) -> bool:
+		with self._lock:
+			if self.failures < self.threshold:
+				return True
+			now = time.monotonic()
+			if now < self.openUntil:
+				return False
+			# half open: let one request probe the daemon
+			self.openUntil = now + self.cooldown
+			return True
+
+	def success(self):
+		with self._lock:
+			self.failures = 0
+
+	def failure(self):
+		with self._lock:
+			self.failures += 1
+			if self.failures >= self.threshold:
+				self.openUntil = time.monotonic() + self.cooldown
+
+
+class rsHost:
+	# some defaults
+	_ip = '127.0.0.1'
+	_port = '9092'
+	_auth = ('test', 'tset')
+	# number of keep-alive connections kept open to the json api
+	_poolSize = 10
+	# (connect, read) in seconds
+	_timeout = (5.0, 60.0)
+	# retries of failed read-only requests
+	_retries = 2
+	_backoff = 0.2
+	# send a second copy of a read-only request not answered after this many seconds
+	_hedgeAfter = None
+
+	def __init__(self, poolSize: int = None, timeout: float = None, cacheTtls: dict = None):
+		parser = argparse.ArgumentParser(description='reads standard RS json API parameters.')
+		parser.add_argument('--port', '-p', help='json api port')
+		parser.add_argument('--addr', '-a', help='json api address')
+		parser.add_argument('--user', '-u', help='json api user')
+		parser.add_argument('--pass', '-P', help='json api password', dest='pw')
+		parser.add_argument('--pool-size', help='number of pooled connections', type=int, dest='poolSize')
+		parser.add_argument('--timeout', help='request timeout in seconds', type=float)
+		parser.add_argument('--no-cache', help='disable the response cache', action='store_true', dest='noCache')
+		parser.add_argument('--cache-events', help='invalidate cached responses on rsEvents', action='store_true', dest='cacheEvents')
+		parser.add_argument('--metrics-json', help='write request metrics to this file on exit', dest='metricsJson')
+		parser.add_argument('--metrics-port', help='serve prometheus metrics on this port', type=int, dest='metricsPort')
+		parser.add_argument('--deadline', help='give up on all requests after this many seconds', type=float)
+		parser.add_argument('--retries', help='retries of failed read-only requests', type=int)
+		parser.add_argument('--hedge-after', help='duplicate slow read-only requests after this many seconds', type=float, dest='hedgeAfter')
+		args, _ = parser.parse_known_args()
+
+		# print(args)
+
+		if args.addr is not None:
+			self._ip = args.addr
+		if args.port is not None:
+			self._port = str(args.port)
+		if args.user is not None and args.pw is not None:
+			self._auth = (args.user, args.pw)
+
+		if poolSize is not None:
+			self._poolSize = poolSize
+		if args.poolSize is not None:
+			self._poolSize = args.poolSize
+		if timeout is not None:
+			self._timeout = timeout
+		if args.timeout is not None:
+			self._timeout = args.timeout
+		if args.retries is not None:
+			self._retries = args.retries
+		if args.hedgeAfter is not None:
+			self._hedgeAfter = args.hedgeAfter
+
+		# absolute time after which no request is sent anymore
+		self._deadline = None
+		if args.deadline is not None:
+			self._deadline = time.monotonic() + args.deadline
+
+		self.breaker = rsCircuitBreaker()
+		self._hedgeExecutor = None
+
+		self._baseUrl = 'http://' + self._ip + ':' + self._port
+
+		# one session for all requests -> connections (and auth) are reused
+		self._session = requests.Session()
+		self._session.auth = self._auth
+		# hedged requests need room for their duplicates
+		poolSize = self._poolSize * (2 if self._hedgeAfter is not None else 1)
+		adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize, pool_block=True)
+		self._session.mount('http://', adapter)
+
+		# cache for read-only endpoints (see rsCache.defaultTtls)
+		self.cache = None if args.noCache else rsResponseCache(cacheTtls)
+		if self.cache is not None and args.cacheEvents:
+			self.watchEvents()
+
+		# per endpoint request statistics
+		self.metrics = rsMetrics()
+		self.metrics.cache = self.cache
+		if args.metricsJson is not None:
+			atexit.register(self.metrics.dumpJson, args.metricsJson)
+		if args.metricsPort is not None:
+			self.metrics.serve(args.metricsPort)
+
+	def setDeadline(self, seconds: float):
+		self._deadline = None if seconds is None else time.monotonic() + seconds
+
+	def _timeoutFor(self, function: str, timeout):
+		if timeout is None:
+			timeout = self._timeout
+		if self._deadline is None:
+			return timeout
+		remaining = self._deadline - time.monotonic()
+		if remaining <= 0:
+			raise rsDeadlineExceeded('deadline exceeded before ' + function)
+		if isinstance(timeout, tuple):
+			return tuple(min(t, remaining) for t in timeout)
+		return min(timeout, remaining)
+
+	def _post(self, function, url, data, timeout):
+		start = time.perf_counter()
+		try:
+			resp = self._session.post(url=url, json=data, timeout=self._timeoutFor(function, timeout))
+		except requests.RequestException:
+			self.metrics.record(function, time.perf_counter() - start)
+			raise
+		self.metrics.record(function, time.perf_counter() - start,
+				len(resp.request.body or b''), len(resp.content), resp.status_code)
+		if resp.status_code >= 500:
+			raise rsApiError(function + ' failed with HTTP ' + str(resp.status_code))
+		return resp
+
+	def _hedged(self, function, url, data, timeout):
+		if self._hedgeExecutor is None:
+			self._hedgeExecutor = ThreadPoolExecutor(max_workers=self._poolSize * 2)
+
+		pending = {self._hedgeExecutor.submit(self._post, function, url, data, timeout)}
+		done, _ = wait(pending, timeout=self._hedgeAfter)
+		if not done:
+			debugDump('HEDGE: ' + url, data)
+			pending.add(self._hedgeExecutor.submit(self._post, function, url, data, timeout))
+
+		# first successful answer wins
+		error = None
+		while pending:
+			done, pending = wait(pending, return_when=FIRST_COMPLETED)
+			for future in done:
+				if future.exception() is None:
+					return future.result()
+				error = future.exception()
+		raise error
+
+	def sendRequest(self, function, data=None, timeout=None):
+		if function[0] != '/':
+			function = '/' + function
+		url = self._baseUrl + function
+
+		cacheable = self.cache is not None and self.cache.cacheable(function)
+		if cacheable:
+			cached = self.cache.get(function, data)
+			if cached is not None:
+				debugDump('CACHED: ' + url, data)
+				return cached
+
+		if not self.breaker.allow():
+			raise rsApiError('json api unresponsive, not sending ' + function)
+
+		readOnly = isReadOnly(function)
+		attempt = 0
+		while True:
+			debugDump('POST: ' + url, data)
+			try:
+				if readOnly and self._hedgeAfter is not None:
+					resp = self._hedged(function, url, data, timeout)
+				else:
+					resp = self._post(function, url, data, timeout)
+				break
+			except rsDeadlineExceeded:
+				# out of the caller's time, not a failure of the daemon
+				raise
+			except (requests.ConnectionError, requests.Timeout, rsApiError) as e:
+				if isinstance(e, requests.Timeout) and self._deadline is not None and time.monotonic() >= self._deadline:
+					# the timeout was cut short by the deadline
+					raise rsDeadlineExceeded('deadline exceeded during ' + function) from e
+				self.breaker.failure()
+				attempt += 1
+				if not readOnly or attempt > self._retries or not self.breaker.allow():
+					raise
+				# exponential backoff with full jitter, bounded by the deadline
+				delay = random.uniform(0, self._backoff * 2 ** attempt)
+				if self._deadline is not None and time.monotonic() + delay >= self._deadline:
+					raise
+				time.sleep(delay)
+		self.breaker.success()
+
+		# gracefully add 401 error
+		if resp.status_code == 401:
+			return {'retval': False}
+
+		# parse once, hand the result to everyone
+		resp = decode(resp.content)
+		debugDump('RESP', resp)
+		if cacheable and resp.get('retval', True):
+			self.cache.put(function, data, resp)
+		return resp
+
+	def iterRequest(self, function, key, data=None):
+		# streams the list stored under key, for huge responses (e.g. getGroupInfoList)
+		if function[0] != '/':
+			function = '/' + function
+		url = self._baseUrl + function
+
+		if not self.breaker.allow():
+			raise rsApiError('json api unresponsive, not sending ' + function)
+
+		debugDump('POST (streaming): ' + url, data)
+		start = time.perf_counter()
+		try:
+			resp = self._session.post(url=url, json=data, timeout=self._timeoutFor(function, None), stream=True)
+		except requests.RequestException:
+			self.metrics.record(function, time.perf_counter() - start)
+			self.breaker.failure()
+			raise
+
+		size = 0
+		try:
+			if resp.status_code >= 500:
+				self.breaker.failure()
+				raise rsApiError(function + ' failed with HTTP ' + str(resp.status_code))
+			self.breaker.success()
+			if resp.status_code == 401:
+				return
+
+			def chunks():
+				nonlocal size
+				for chunk in resp.iter_content(chunk_size=65536):
+					size += len(chunk)
+					yield chunk
+
+			yield from iterArray(chunks(), key)
+		finally:
+			resp.close()
+			self.metrics.record(function, time.perf_counter() - start,
+					len(resp.request.body or b''), size, resp.status_code)
+
+	def getEventsStream(self, eventType: int = 0):
+		from sseclient import SSEClient
+		for mRecord in SSEClient(
+				self._baseUrl + '/rsEvents/registerEventsHandler',
+				auth=self._auth,
+				json={"eventType": eventType}):
+			try:
+				mEvent = json.loads(mRecord.data)["event"]
+				## Older RetroShare version doesn't filter events type
+				if (mEvent["mType"] == eventType or eventType == 0):
+					yield mEvent
+			except(KeyError):
+				if json.loads(mRecord.data)["retval"]:
+					continue
+			except(TypeError):
+				print(mRecord)
+				print("Got invalid record:", mRecord.dump().encode("utf8"))
+
+	def watchEvents(self, *handlers):
+		# keep the cache (and whoever else wants to know) consistent with the daemon in the background
+		def watch():
+			for event in self.getEventsStream(0):
+				if self.cache is not None:
+					self.cache.onEvent(event)
+				for handler in handlers:
+					handler(event)
+
+		thread = threading.Thread(target=watch, name='rsCacheEvents', daemon=True)
+		thread.start()
+		return thread
+
+	def close(self):
+		if self._hedgeExecutor is not None:
+			# losing duplicates may still wait for their answer, they fail once the session is closed
+			self._hedgeExecutor.shutdown(wait=False)
+		self._session.close()
+
+
+class rsHostAsync:
+	# number of requests in flight at the same time
+	_concurrency = 16
+
+	def __init__(self, rs: rsHost = None, concurrency: int = None):
+		parser = argparse.ArgumentParser(description='reads async RS json API parameters.')
+		parser.add_argument('--concurrency', '-j', help='number of parallel requests', type=int)
+		args, _ = parser.parse_known_args()
+
+		if concurrency is not None:
+			self._concurrency = concurrency
+		if args.concurrency is not None:
+			self._concurrency = args.concurrency
+
+		# the pool must be able to serve all workers at once
+		if rs is None:
+			rs = rsHost(poolSize=self._concurrency)
+		self.rs = rs
+
+		# requests is blocking -> run it on worker threads sharing the pooled session
+		self._executor = ThreadPoolExecutor(max_workers=self._concurrency)
+
+	async def sendRequest(self, function, data=None):
+		import asyncio
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self._executor, self.rs.sendRequest, function, data)
+
+	async def gather(self, function, datas, concurrency: int = None) -> list:
+		# returns the responses in the same order as datas
+		import asyncio
+		sem = asyncio.Semaphore(concurrency if concurrency is not None else self._concurrency)
+
+		async def send(data):
+			async with sem:
+				return await self.sendRequest(function, data)
+
+		return await asyncio.gather(*[send(data) for data in datas])
+
+	def close(self):
+		self._executor.shutdown()
+		self.rs.close()
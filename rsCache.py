@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import json, time, copy, threading
+from collections import OrderedDict
+
+# read-only endpoints worth caching -> ttl in seconds
+defaultTtls = {
+	'/rsPeers/getPeerDetails': 60,
+	'/rsIdentity/getIdDetails': 300,
+	'/rsMsgs/getChatLobbyInfo': 60,
+	'/rsServiceControl/getOwnServices': 3600,
+}
+
+# rsEvents type -> endpoint prefixes that become stale
+# (see RsEventType in retroshare/rsevents.h)
+eventInvalidations = {
+	4: ['/rsPeers/'],     # PEER_CONNECTION
+	6: ['/rsPeers/'],     # PEER_STATE_CHANGED
+	12: ['/rsIdentity/'], # GXS_IDENTITY
+	18: ['/rsPeers/'],    # FRIEND_LIST
+}
+
+
+class rsResponseCache:
+	def __init__(self, ttls: dict = None, maxSize: int = 4096):
+		self.ttls = dict(defaultTtls if ttls is None else ttls)
+		self.maxSize = maxSize
+		# (function, body) -> (expires, response)
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+		# function -> [hits, misses]
+		self.counters = {}
+
+	@staticmethod
+	def key(function: str, data) -> tuple:
+		return (function, json.dumps(data, sort_keys=True, separators=(',', ':')))
+
+	def cacheable(self, function: str) -> bool:
+		return function in self.ttls
+
+	def get(self, function: str, data):
+		key = self.key(function, data)
+		with self._lock:
+			counter = self.counters.setdefault(function, [0, 0])
+			entry = self._entries.get(key)
+			if entry is None or entry[0] < time.monotonic():
+				if entry is not None:
+					del self._entries[key]
+				counter[1] += 1
+				return None
+			self._entries.move_to_end(key)
+			counter[0] += 1
+		# callers are free to modify what they get
+		return copy.deepcopy(entry[1])
+
+	def put(self, function: str, data, resp):
+		key = self.key(function, data)
+		with self._lock:
+			self._entries[key] = (time.monotonic() + self.ttls[function], copy.deepcopy(resp))
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxSize:
+				self._entries.popitem(last=False)
+
+	def discard(self, function: str, data):
+		with self._lock:
+			self._entries.pop(self.key(function, data), None)
+
+	def invalidate(self, prefix: str = '', needle: str = None):
+		# drop all entries of endpoints starting with prefix (and mentioning needle in their request)
+		with self._lock:
+			for key in [k for k in self._entries if k[0].startswith(prefix) and (needle is None or needle in k[1])]:
+				del self._entries[key]
+
+	def onEvent(self, event: dict):
+		prefixes = eventInvalidations.get(event.get('mType'), [])
+		needle = event.get('mSslId', event.get('mIdentityId'))
+		for prefix in prefixes:
+			self.invalidate(prefix, needle)
+
+	def hits(self) -> int:
+		return sum(c[0] for c in self.counters.values())
+
+	def misses(self) -> int:
+		return sum(c[1] for c in self.counters.values())
+
+	def __len__(self):
+		return len(self._entries)
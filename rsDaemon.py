@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# runs the maintenance jobs periodically against one warm client and one shared friend snapshot
+#
+#   ./rstool.py daemon --job bury=3600 --job autoperms=3600 --job discoverview=86400 --events
+#
+# autoperms reloads its rule file (see autoPermissions.rulesPath, --rules) and reruns when it changes,
+# with --events also when a friend is added.
+
+import os, time, heapq, random, argparse, importlib, threading, traceback
+from rsApi import rsHostAsync
+from rsFriends import fetch_friend_snapshot
+
+# job -> (module providing run(ars, snap), default interval in seconds)
+jobs = {
+	'bury': ('buryTheDead', 3600),
+	'autoperms': ('autoPermissions', 3600),
+	'ipoverview': ('ipOverview', 24 * 3600),
+	'discoverview': ('discOverview', 24 * 3600),
+}
+
+
+class rsScheduler:
+	def __init__(self, ars: rsHostAsync, jitter: float = 0.1, refreshAfter: float = 60, fullRefreshAfter: float = 6 * 3600):
+		self.ars = ars
+		self.snap = None
+		# +- fraction of the interval
+		self.jitter = jitter
+		# seconds before the shared snapshot is refreshed (incrementally / completely)
+		self.refreshAfter = refreshAfter
+		self.fullRefreshAfter = fullRefreshAfter
+		# (next run, job)
+		self.queue = []
+		self.intervals = {}
+		# path -> [job, last mtime], jobs rerun right away when their file changes
+		self.watches = {}
+		# (predicate, job), jobs rerun right away when a matching event comes in
+		self.triggers = []
+		self.pending = set()
+		self._lock = threading.Lock()
+		self.pollInterval = 5
+
+	def add(self, name: str, interval: float = None):
+		if interval is None:
+			interval = jobs[name][1]
+		self.intervals[name] = interval
+		heapq.heappush(self.queue, (time.time(), name))
+
+	def watch(self, path: str, name: str):
+		path = os.path.expanduser(path)
+		self.watches[path] = [name, self.mtime(path)]
+
+	@staticmethod
+	def mtime(path: str):
+		try:
+			return os.stat(path).st_mtime_ns
+		except OSError:
+			return None
+
+	def checkWatches(self):
+		for path, watch in self.watches.items():
+			mtime = self.mtime(path)
+			if mtime == watch[1]:
+				continue
+			watch[1] = mtime
+			print(path + ' changed, rerunning ' + watch[0])
+			self.rerun(watch[0])
+
+		with self._lock:
+			pending, self.pending = self.pending, set()
+		for name in pending:
+			print('event for ' + name + ', rerunning it')
+			self.rerun(name)
+
+	def rerun(self, name: str):
+		self.queue = [(when, job) for when, job in self.queue if job != name]
+		heapq.heapify(self.queue)
+		heapq.heappush(self.queue, (time.time(), name))
+
+	def trigger(self, predicate, name: str):
+		self.triggers.append((predicate, name))
+
+	def onEvent(self, event: dict):
+		# called from the event thread
+		if self.snap is not None:
+			self.snap.onEvent(event)
+		for predicate, name in self.triggers:
+			if predicate(event):
+				with self._lock:
+					self.pending.add(name)
+
+	def snapshot(self):
+		now = time.time()
+		if self.snap is None:
+			self.snap = fetch_friend_snapshot(self.ars)
+			print('fetched ' + str(len(self.snap)) + ' friends')
+		elif now - self.snap.fullTime > self.fullRefreshAfter:
+			num = self.snap.refresh(self.ars, True)
+			print('refreshed all ' + str(num) + ' friends')
+		elif now - self.snap.time > self.refreshAfter:
+			num = self.snap.refresh(self.ars)
+			print('refreshed ' + str(num) + ' friends')
+		return self.snap
+
+	def runJob(self, name: str):
+		module = importlib.import_module(jobs[name][0])
+		print('running ' + name)
+		start = time.time()
+		try:
+			module.run(self.ars, self.snapshot())
+		except Exception:
+			# one broken job must not take the others down
+			traceback.print_exc()
+		print(name + ' done after ' + '{:.1f}'.format(time.time() - start) + 's')
+
+	def run(self):
+		while self.queue:
+			when, name = self.queue[0]
+			delay = when - time.time()
+			if delay > 0:
+				time.sleep(min(delay, self.pollInterval) if self.watches or self.triggers else delay)
+				self.checkWatches()
+				continue
+			heapq.heappop(self.queue)
+			self.runJob(name)
+
+			interval = self.intervals[name]
+			heapq.heappush(self.queue, (time.time() + interval * (1 + random.uniform(-self.jitter, self.jitter)), name))
+
+
+def main():
+	parser = argparse.ArgumentParser(description='runs maintenance jobs periodically')
+	parser.add_argument('--job', help='job[=interval in seconds], one of ' + ', '.join(jobs) + ' (repeatable)', action='append', dest='jobs')
+	parser.add_argument('--jitter', help='random +- fraction of the interval', type=float, default=0.1)
+	parser.add_argument('--refresh', help='seconds before friends are refreshed incrementally', type=float, default=60)
+	parser.add_argument('--full-refresh', help='seconds before all friends are refetched', type=float, default=6 * 3600, dest='fullRefresh')
+	parser.add_argument('--events', help='track peer changes through rsEvents', action='store_true')
+	parser.add_argument('--rules', help='autoperms rule file, reloaded and applied when it changes')
+	args, _ = parser.parse_known_args()
+
+	ars = rsHostAsync()
+	scheduler = rsScheduler(ars, args.jitter, args.refresh, args.fullRefresh)
+
+	for job in args.jobs or ['bury', 'autoperms']:
+		name, _, interval = job.partition('=')
+		if name not in jobs:
+			print('unknown job ' + name)
+			return 1
+		scheduler.add(name, float(interval) if interval else None)
+
+	if 'autoperms' in scheduler.intervals:
+		autoPermissions = importlib.import_module('autoPermissions')
+		if args.rules:
+			autoPermissions.rulesPath = args.rules
+		scheduler.watch(autoPermissions.rulesPath, 'autoperms')
+		if args.events:
+			# new friends get their permissions right away
+			scheduler.trigger(autoPermissions.isFriendAdded, 'autoperms')
+
+	if args.events:
+		ars.rs.watchEvents(scheduler.onEvent)
+
+	try:
+		scheduler.run()
+	except KeyboardInterrupt:
+		pass
+	return 0
+
+
+if __name__ == "__main__":
+	main()
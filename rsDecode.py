@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import json, codecs
+
+# use a faster decoder when one is installed
+try:
+	import orjson
+	loads = orjson.loads
+	decoderName = 'orjson'
+except ImportError:
+	try:
+		import ujson
+		loads = ujson.loads
+		decoderName = 'ujson'
+	except ImportError:
+		loads = json.loads
+		decoderName = 'json'
+
+_whitespace = ' \t\n\r'
+
+
+def decode(content: bytes):
+	# parses a whole response body, exactly once
+	return loads(content)
+
+
+class _stream:
+	def __init__(self, chunks):
+		self._chunks = iter(chunks)
+		self._utf8 = codecs.getincrementaldecoder('utf-8')()
+		self._decoder = json.JSONDecoder()
+		self.buf = ''
+		self.pos = 0
+		self.eof = False
+
+	def more(self) -> bool:
+		if self.eof:
+			return False
+		# drop what was consumed already
+		if self.pos > 65536:
+			self.buf = self.buf[self.pos:]
+			self.pos = 0
+		for chunk in self._chunks:
+			if chunk:
+				self.buf += self._utf8.decode(chunk)
+				return True
+		self.buf += self._utf8.decode(b'', final=True)
+		self.eof = True
+		return False
+
+	def peek(self) -> str:
+		# next non-whitespace character ('' at the end)
+		while True:
+			while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+				self.pos += 1
+			if self.pos < len(self.buf):
+				return self.buf[self.pos]
+			if not self.more():
+				return ''
+
+	def expect(self, chars: str) -> str:
+		c = self.peek()
+		if c == '' or c not in chars:
+			raise ValueError('expected one of ' + repr(chars) + ' at offset ' + str(self.pos) + ', got ' + repr(c))
+		self.pos += 1
+		return c
+
+	def value(self):
+		self.peek()
+		while True:
+			try:
+				obj, end = self._decoder.raw_decode(self.buf, self.pos)
+				# a number could continue in the next chunk
+				if self.eof or (end < len(self.buf) and self.buf[end] not in '.eE+-'):
+					self.pos = end
+					return obj
+			except json.JSONDecodeError:
+				if self.eof:
+					raise
+			self.more()
+
+
+def iterArray(chunks, key: str):
+	# yields the elements of the array stored under key in the top level object,
+	# without materialising the whole document. chunks is an iterable of bytes.
+	s = _stream(chunks)
+	s.expect('{')
+	if s.peek() == '}':
+		return
+	while True:
+		name = s.value()
+		s.expect(':')
+		if name == key and s.peek() == '[':
+			s.pos += 1
+			if s.peek() == ']':
+				return
+			while True:
+				yield s.value()
+				if s.expect(',]') == ']':
+					return
+		s.value()
+		if s.expect(',}') == '}':
+			return
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import time, asyncio
+from rsApi import rsHostAsync
+
+# rsEvents types telling that a location's details changed (see RsEventType)
+peerEvents = [
+	4,  # PEER_CONNECTION
+	6,  # PEER_STATE_CHANGED
+	18, # FRIEND_LIST
+]
+
+class rsFriendSnapshot:
+	def __init__(self):
+		# sslId -> peer details
+		self.details = {}
+		# gpg_id -> [sslId, ...]
+		self.byGpgId = {}
+		# sslIds the daemon refused details for (retval: false)
+		self.failed = set()
+		self.time = time.time()
+		# time of the last complete fetch
+		self.fullTime = self.time
+		# sslIds whose details are known to be outdated
+		self.dirty = set()
+
+	@classmethod
+	def fromDetails(cls, details: dict):
+		# sslId -> details
+		snap = cls()
+		for sslId, det in details.items():
+			snap.add(sslId, det)
+		return snap
+
+	def add(self, sslId: str, det: dict):
+		if sslId in self.details:
+			self.remove(sslId)
+		self.details[sslId] = det
+		self.byGpgId.setdefault(det['gpg_id'], []).append(sslId)
+		self.failed.discard(sslId)
+
+	def remove(self, sslId: str):
+		det = self.details.pop(sslId, None)
+		if det is None:
+			return
+		locations = self.byGpgId[det['gpg_id']]
+		locations.remove(sslId)
+		if not locations:
+			del self.byGpgId[det['gpg_id']]
+
+	def sslIds(self) -> list:
+		return list(self.details)
+
+	def markDirty(self, sslId: str):
+		self.dirty.add(sslId)
+
+	def onEvent(self, event: dict):
+		if event.get('mType') in peerEvents and event.get('mSslId'):
+			self.markDirty(event['mSslId'])
+
+	def refresh(self, ars: rsHostAsync, full: bool = False):
+		return asyncio.run(self.refreshAsync(ars, full))
+
+	async def refreshAsync(self, ars: rsHostAsync, full: bool = False):
+		# only fetch what can have changed: new friends, dirty and connected locations
+		friends = list(dict.fromkeys((await ars.sendRequest('/rsPeers/getFriendList'))['sslIds']))
+		current = set(friends)
+		for sslId in [sslId for sslId in self.details if sslId not in current]:
+			self.remove(sslId)
+		self.failed &= current
+
+		dirty, self.dirty = self.dirty, set()
+		if full:
+			update = friends
+		else:
+			update = [sslId for sslId in friends if sslId not in self.details or sslId in dirty or sslId in self.failed
+					or self.details[sslId]['connectAddr'] != '']
+
+		# don't get served stale details
+		if ars.rs.cache is not None:
+			for sslId in update:
+				ars.rs.cache.discard('/rsPeers/getPeerDetails', {'sslId': sslId})
+
+		responses = await ars.gather('/rsPeers/getPeerDetails', [{'sslId': sslId} for sslId in update])
+		for sslId, resp in zip(update, responses):
+			if not resp.get('retval') or 'det' not in resp:
+				self.remove(sslId)
+				self.failed.add(sslId)
+				continue
+			self.add(sslId, resp['det'])
+
+		self.time = time.time()
+		if full:
+			self.fullTime = self.time
+		return len(update)
+
+	def __len__(self):
+		return len(self.details)
+
+	def __contains__(self, sslId):
+		return sslId in self.details
+
+
+async def fetch_friend_snapshot_async(ars: rsHostAsync, friends: list = None) -> rsFriendSnapshot:
+	if friends is None:
+		friends = (await ars.sendRequest('/rsPeers/getFriendList'))['sslIds']
+	# drop duplicates but keep the daemon's order
+	friends = list(dict.fromkeys(friends))
+
+	snap = rsFriendSnapshot()
+	responses = await ars.gather('/rsPeers/getPeerDetails', [{'sslId': friend} for friend in friends])
+	for friend, resp in zip(friends, responses):
+		if not resp.get('retval') or 'det' not in resp:
+			snap.failed.add(friend)
+			continue
+		snap.add(friend, resp['det'])
+	return snap
+
+def fetch_friend_snapshot(ars: rsHostAsync, friends: list = None) -> rsFriendSnapshot:
+	return asyncio.run(fetch_friend_snapshot_async(ars, friends))
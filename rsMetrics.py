@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import json, threading
+
+# latency histogram bucket upper bounds in seconds
+buckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf')]
+
+
+class rsEndpointStats:
+	def __init__(self):
+		self.calls = 0
+		self.errors = 0
+		self.unauthorized = 0
+		self.requestBytes = 0
+		self.responseBytes = 0
+		self.latencySum = 0.0
+		self.histogram = [0] * len(buckets)
+
+	def add(self, latency: float, requestBytes: int, responseBytes: int, status: int):
+		self.calls += 1
+		self.latencySum += latency
+		self.requestBytes += requestBytes
+		self.responseBytes += responseBytes
+		if status == 401:
+			self.unauthorized += 1
+		elif status is None or status >= 400:
+			self.errors += 1
+		for n, bound in enumerate(buckets):
+			if latency <= bound:
+				self.histogram[n] += 1
+				break
+
+	def percentile(self, q: float) -> float:
+		# estimated from the histogram, interpolating inside the bucket
+		if self.calls == 0:
+			return 0.0
+		rank = q * self.calls
+		seen = 0
+		lower = 0.0
+		for n, count in enumerate(self.histogram):
+			if count and seen + count >= rank:
+				upper = buckets[n]
+				if upper == float('inf'):
+					return lower
+				return lower + (upper - lower) * (rank - seen) / count
+			seen += count
+			lower = buckets[n]
+		return lower
+
+	def summary(self) -> dict:
+		return {
+			'calls': self.calls,
+			'errors': self.errors,
+			'unauthorized': self.unauthorized,
+			'requestBytes': self.requestBytes,
+			'responseBytes': self.responseBytes,
+			'latencyAvg': self.latencySum / self.calls if self.calls else 0.0,
+			'latencyP50': self.percentile(0.50),
+			'latencyP95': self.percentile(0.95),
+			'latencyP99': self.percentile(0.99),
+		}
+
+
+class rsMetrics:
+	def __init__(self):
+		# function -> rsEndpointStats
+		self.endpoints = {}
+		# optional rsResponseCache, reported along
+		self.cache = None
+		self._lock = threading.Lock()
+
+	def record(self, function: str, latency: float, requestBytes: int = 0, responseBytes: int = 0, status: int = None):
+		# status None means the request did not complete
+		with self._lock:
+			stats = self.endpoints.get(function)
+			if stats is None:
+				stats = self.endpoints[function] = rsEndpointStats()
+			stats.add(latency, requestBytes, responseBytes, status)
+
+	def summary(self) -> dict:
+		with self._lock:
+			data = {'endpoints': {function: stats.summary() for function, stats in sorted(self.endpoints.items())}}
+		if self.cache is not None:
+			data['cache'] = {function: {'hits': c[0], 'misses': c[1]} for function, c in sorted(self.cache.counters.items())}
+		return data
+
+	def dumpJson(self, path: str):
+		with open(path, 'w') as f:
+			json.dump(self.summary(), f, indent=4)
+
+	def prometheus(self) -> str:
+		lines = []
+
+		def add(name: str, kind: str, help: str):
+			lines.append('# HELP rs_jsonapi_' + name + ' ' + help)
+			lines.append('# TYPE rs_jsonapi_' + name + ' ' + kind)
+
+		with self._lock:
+			endpoints = sorted(self.endpoints.items())
+
+			add('requests_total', 'counter', 'JSON API requests')
+			for function, s in endpoints:
+				lines.append('rs_jsonapi_requests_total{endpoint="%s"} %d' % (function, s.calls))
+			add('errors_total', 'counter', 'failed JSON API requests (excluding 401)')
+			for function, s in endpoints:
+				lines.append('rs_jsonapi_errors_total{endpoint="%s"} %d' % (function, s.errors))
+			add('unauthorized_total', 'counter', 'JSON API requests answered with 401')
+			for function, s in endpoints:
+				lines.append('rs_jsonapi_unauthorized_total{endpoint="%s"} %d' % (function, s.unauthorized))
+			add('request_bytes_total', 'counter', 'request body bytes sent')
+			for function, s in endpoints:
+				lines.append('rs_jsonapi_request_bytes_total{endpoint="%s"} %d' % (function, s.requestBytes))
+			add('response_bytes_total', 'counter', 'response body bytes received')
+			for function, s in endpoints:
+				lines.append('rs_jsonapi_response_bytes_total{endpoint="%s"} %d' % (function, s.responseBytes))
+
+			add('request_duration_seconds', 'histogram', 'JSON API request latency')
+			for function, s in endpoints:
+				total = 0
+				for bound, count in zip(buckets, s.histogram):
+					total += count
+					le = '+Inf' if bound == float('inf') else repr(bound)
+					lines.append('rs_jsonapi_request_duration_seconds_bucket{endpoint="%s",le="%s"} %d' % (function, le, total))
+				lines.append('rs_jsonapi_request_duration_seconds_sum{endpoint="%s"} %f' % (function, s.latencySum))
+				lines.append('rs_jsonapi_request_duration_seconds_count{endpoint="%s"} %d' % (function, s.calls))
+
+		if self.cache is not None:
+			counters = sorted(self.cache.counters.items())
+			add('cache_hits_total', 'counter', 'responses served from the cache')
+			for function, c in counters:
+				lines.append('rs_jsonapi_cache_hits_total{endpoint="%s"} %d' % (function, c[0]))
+			add('cache_misses_total', 'counter', 'cacheable requests sent to the daemon')
+			for function, c in counters:
+				lines.append('rs_jsonapi_cache_misses_total{endpoint="%s"} %d' % (function, c[1]))
+
+		return '\n'.join(lines) + '\n'
+
+	def serve(self, port: int, addr: str = '127.0.0.1'):
+		# prometheus scrape endpoint on http://addr:port/metrics
+		from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+		metrics = self
+
+		class handler(BaseHTTPRequestHandler):
+			def log_message(self, format, *args):
+				pass
+
+			def do_GET(self):
+				if self.path != '/metrics':
+					self.send_error(404)
+					return
+				body = metrics.prometheus().encode()
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain; version=0.0.4')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+		server = ThreadingHTTPServer((addr, port), handler)
+		server.daemon_threads = True
+		threading.Thread(target=server.serve_forever, name='rsMetrics', daemon=True).start()
+		return server
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import os, json
+
+class rsStateFile:
+	# json file a script keeps between runs, holding the attributes named in fields.
+	# Subclasses set their defaults, then call load(). A missing, broken or incomplete file
+	# (truncated, hand edited, written by an older version) keeps the defaults -> start over.
+	fields = []
+
+	def __init__(self, path: str):
+		self.path = os.path.expanduser(path)
+
+	def load(self) -> bool:
+		try:
+			with open(self.path) as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			return False
+		if not isinstance(data, dict) or any(field not in data for field in self.fields) or not self.valid(data):
+			return False
+		for field in self.fields:
+			setattr(self, field, data[field])
+		return True
+
+	def valid(self, data: dict) -> bool:
+		# whether a complete file can still be used
+		return True
+
+	def save(self):
+		# written next to it and moved over, a crash never leaves half a file behind
+		tmp = self.path + '.tmp'
+		with open(tmp, 'w') as f:
+			json.dump({field: getattr(self, field) for field in self.fields}, f, separators=(',', ':'))
+		os.replace(tmp, self.path)
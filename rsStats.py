@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# keeps the aggregates of every discoverview / ipoverview run, and shows how they develop
+#
+#   ./rstool.py stats --source discoverview --metric version: --days 90 --bucket day
+#
+# old samples are averaged into hourly and daily ones (see downsampling), so the file stays small.
+
+import os, time, argparse
+
+statsPath = '~/.rsStats.sqlite'
+
+# samples older than age (seconds) are merged into buckets of resolution (seconds)
+downsampling = [
+	(7 * 24 * 3600, 3600),
+	(90 * 24 * 3600, 24 * 3600),
+]
+
+# one sample of this per run and source: metrics left out of a run (versions nobody uses anymore)
+# count as 0 when averaging, instead of only averaging the runs that had them
+runsMetric = 'runs'
+
+buckets = {'raw': 0, 'hour': 3600, 'day': 24 * 3600, 'week': 7 * 24 * 3600}
+
+
+class rsStatsStore:
+	def __init__(self, path: str = None):
+		import sqlite3
+		self.path = os.path.expanduser(path or statsPath)
+		self.db = sqlite3.connect(self.path)
+		# resolution: 0 for a raw sample, else the bucket size it was averaged over
+		# count: number of runs behind the value, to average averages correctly
+		self.db.executescript('''
+			CREATE TABLE IF NOT EXISTS samples (
+				time INTEGER NOT NULL,
+				resolution INTEGER NOT NULL,
+				source TEXT NOT NULL,
+				metric TEXT NOT NULL,
+				value REAL NOT NULL,
+				count INTEGER NOT NULL
+			);
+			CREATE INDEX IF NOT EXISTS samplesBySeries ON samples (source, metric, time);
+			CREATE INDEX IF NOT EXISTS samplesByAge ON samples (resolution, time);
+		''')
+
+	def record(self, source: str, values: dict, now: float = None):
+		now = int(now if now is not None else time.time())
+		with self.db:
+			self.db.executemany('INSERT INTO samples VALUES (?, 0, ?, ?, ?, 1)',
+				[(now, source, metric, value) for metric, value in list(values.items()) + [(runsMetric, 1)]])
+		self.downsample(now)
+
+	def downsample(self, now: float = None):
+		now = int(now if now is not None else time.time())
+		with self.db:
+			for age, resolution in downsampling:
+				# only complete buckets, older than age
+				cutoff = now - age
+				cutoff -= cutoff % resolution
+				# buckets holding finer samples, together with what was merged into them before
+				where = '''{t}resolution <= ?1 AND {t}time < ?2 AND {t}time - {t}time % ?1 IN
+					(SELECT time - time % ?1 FROM samples WHERE resolution < ?1 AND time < ?2)'''
+				self.db.execute('''
+					CREATE TEMP TABLE runs AS
+					SELECT time - time % ?1 AS time, source, SUM(count) AS runs
+					FROM samples WHERE metric = ?3 AND ''' + where.format(t='') + '''
+					GROUP BY time - time % ?1, source
+				''', (resolution, cutoff, runsMetric))
+				# the average over all runs of the bucket, not only the ones a metric showed up in
+				self.db.execute('''
+					CREATE TEMP TABLE merged AS
+					SELECT s.time - s.time % ?1 AS time, ?1 AS resolution, s.source, s.metric,
+						SUM(s.value * s.count) / COALESCE(r.runs, SUM(s.count)) AS value, COALESCE(r.runs, SUM(s.count)) AS count
+					FROM samples s LEFT JOIN runs r ON r.time = s.time - s.time % ?1 AND r.source = s.source
+					WHERE ''' + where.format(t='s.') + '''
+					GROUP BY s.time - s.time % ?1, s.source, s.metric
+				''', (resolution, cutoff))
+				self.db.execute('DELETE FROM samples WHERE ' + where.format(t=''), (resolution, cutoff))
+				self.db.execute('INSERT INTO samples SELECT * FROM merged')
+				self.db.execute('DROP TABLE merged')
+				self.db.execute('DROP TABLE runs')
+
+	def query(self, source: str, metric: str = '', since: float = 0, bucket: int = 0) -> dict:
+		# metric -> [(time, value)], averaged over the runs of each bucket, metric matches by prefix
+		size = max(bucket, 1)
+		rows = self.db.execute('''
+			WITH runs AS (
+				SELECT time - time % ?1 AS time, SUM(count) AS runs FROM samples
+				WHERE source = ?2 AND metric = ?6 AND time >= ?5
+				GROUP BY time - time % ?1
+			)
+			SELECT s.time - s.time % ?1, s.metric, SUM(s.value * s.count) / COALESCE(r.runs, SUM(s.count))
+			FROM samples s LEFT JOIN runs r ON r.time = s.time - s.time % ?1
+			WHERE s.source = ?2 AND s.metric != ?6 AND substr(s.metric, 1, ?3) = ?4 AND s.time >= ?5
+			GROUP BY s.time - s.time % ?1, s.metric ORDER BY 1
+		''', (size, source, len(metric), metric, int(since), runsMetric))
+		series = {}
+		for when, name, value in rows:
+			series.setdefault(name, []).append((when, value))
+		return series
+
+	def sources(self) -> list:
+		return [row[0] for row in self.db.execute('SELECT DISTINCT source FROM samples ORDER BY 1')]
+
+	def close(self):
+		self.db.close()
+
+
+def record(source: str, values: dict):
+	store = rsStatsStore()
+	try:
+		store.record(source, values)
+	finally:
+		store.close()
+
+
+def main():
+	parser = argparse.ArgumentParser(description='shows how the recorded statistics developed')
+	parser.add_argument('--source', help='discoverview or ipoverview (default: all)')
+	parser.add_argument('--metric', help='only metrics starting with this, e.g. version: or ipv4', default='')
+	parser.add_argument('--days', help='how far back to look', type=float, default=30)
+	parser.add_argument('--bucket', help='average per ' + ', '.join(buckets), choices=list(buckets), default='day')
+	parser.add_argument('--top', help='at most this many metrics, by latest value', type=int, default=8)
+	parser.add_argument('--db', help='statistics file (default ' + statsPath + ')')
+	args, _ = parser.parse_known_args()
+
+	store = rsStatsStore(args.db)
+	since = time.time() - args.days * 24 * 3600
+	for source in [args.source] if args.source else store.sources():
+		series = store.query(source, args.metric, since, buckets[args.bucket])
+		if not series:
+			continue
+		# the metrics that matter most right now
+		metrics = sorted(series, key=lambda m: (-series[m][-1][1], m))[:args.top]
+		times = sorted({when for m in metrics for when, _ in series[m]})
+		values = {m: dict(series[m]) for m in metrics}
+
+		# without the common prefix asked for
+		names = [m[len(args.metric):] or m for m in metrics]
+		widths = [max(len(name), 8) + 2 for name in names]
+
+		print(source + ':')
+		print('{:16}'.format('') + ''.join(name.rjust(width) for name, width in zip(names, widths)))
+		for when in times:
+			row = [('{:.1f}'.format(values[m][when]) if when in values[m] else '-').rjust(width) for m, width in zip(metrics, widths)]
+			print('{:16}'.format(time.strftime('%Y-%m-%d %H:%M', time.localtime(when))) + ''.join(row))
+		print('')
+	store.close()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+
+# graveyard aging tiers, used by buryTheDead (moves friends between the groups)
+# and autoPermissions (applies the presets to the groups' members)
+#
+# friends offline for more than 'days' go to 'group', each friend is only kept in the oldest tier it reached.
+# 'preset' names an autoPermissions preset applied to the group's members (see autoPermissions.presets)
+tiers = [
+	# {'days': 7, 'group': 'Sleeping', 'preset': None},
+	{'days': 30, 'group': 'Graveyard', 'preset': 'Graveyard'},
+	# {'days': 180, 'group': 'Crypt', 'preset': 'Graveyard'},
+]
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# parses the version strings returned by /rsGossipDiscovery/getPeerVersion
+#
+#   ./rsVersion.py [corpus] [rounds]
+#
+# checks the parser against a corpus (default versionCorpus.txt) and times it against the old per peer parsing,
+# exits with 1 when a string is not parsed as listed in the corpus
+
+import re, sys, time, functools
+
+# 0.6.4 Revision 90393419
+revisionRegEx = re.compile(r'(.*)\sRevision\s([a-f0-9]+)')
+# v0.6.4-481-gfe5e83125, 0.6.9999-208-g62ab99fc4-OBS
+describeRegEx = re.compile('(.+-?.+)-(.+)-(.+)')
+# whatever int(x, 16) accepts
+hexRegEx = re.compile('[0-9a-fA-F]+(?:_[0-9a-fA-F]+)*')
+
+# for grouping unknown version strings
+hashRegEx = re.compile('[0-9a-f]{7,}')
+numberRegEx = re.compile('[0-9]+')
+
+
+@functools.lru_cache(maxsize=4096)
+def parseVersion(versionStr: str):
+	# -> (version, git hash), None if not understood
+	# thousands of peers share a handful of strings, so every string is only parsed once
+	match = revisionRegEx.search(versionStr)
+	if match is None:
+		match = describeRegEx.search(versionStr)
+		if match is None:
+			return None
+		version = match.group(1)
+		if match.group(3)[0] == 'g':
+			git = match.group(3)[1:]
+		elif match.group(2)[0] == 'g':
+			# 0.6.9999-208-g62ab99fc4-OBS
+			git = match.group(2)[1:]
+		else:
+			return None
+	else:
+		version = match.group(1)
+		git = match.group(2)
+
+	# some sanity checks, this is supposed to be a hexadecimal string
+	if len(git) < 5 or hexRegEx.fullmatch(git) is None:
+		return None
+	return version, git
+
+
+def versionPattern(versionStr: str) -> str:
+	# v0.6.5-RC1 -> vN.N.N-RCN, 0.6.4 Revision 90393419 -> N.N.N Revision <hash>
+	return numberRegEx.sub('N', hashRegEx.sub('<hash>', versionStr))
+
+
+def parseVersionUncached(versionStr: str):
+	# the way discOverview parsed every peer before, kept as the benchmark's baseline
+	match = re.search(r'(.*)\sRevision\s([a-f0-9]+)', versionStr)
+	if match == None:
+		match = re.search('(.+-?.+)-(.+)-(.+)', versionStr)
+		if match == None:
+			return None
+		version = match.group(1)
+		if match.group(3)[0] == 'g':
+			git = match.group(3)[1:]
+		else:
+			if match.group(2)[0] == 'g':
+				git = match.group(2)[1:]
+			else:
+				return None
+	else:
+		version = match.group(1)
+		git = match.group(2)
+
+	if len(git) < 5:
+		return None
+	try:
+		int('0x' + git, 16)
+	except ValueError:
+		return None
+	return version, git
+
+
+def loadCorpus(path: str) -> list:
+	# version string<TAB>version<TAB>hash, '-' for strings that are not understood
+	corpus = []
+	with open(path) as f:
+		for entry in f:
+			entry = entry.rstrip('\n')
+			if not entry or entry.startswith('#'):
+				continue
+			versionStr, version, git = entry.split('\t')
+			corpus.append((versionStr, None if version == '-' else (version, git)))
+	return corpus
+
+
+def main():
+	path = sys.argv[1] if len(sys.argv) > 1 else 'versionCorpus.txt'
+	rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+	corpus = loadCorpus(path)
+
+	failed = 0
+	for versionStr, expected in corpus:
+		for parser in [parseVersion, parseVersionUncached]:
+			if parser(versionStr) != expected:
+				failed += 1
+				print(parser.__name__ + ': ' + repr(versionStr) + ' -> ' + repr(parser(versionStr)) + ', expected ' + repr(expected))
+	print(str(len(corpus)) + ' version strings, ' + str(failed) + ' failed')
+
+	# like a network: every string seen by many peers
+	peers = [versionStr for versionStr, _ in corpus] * rounds
+	for parser in [parseVersionUncached, parseVersion]:
+		start = time.perf_counter()
+		for versionStr in peers:
+			parser(versionStr)
+		elapsed = time.perf_counter() - start
+		print('{:24}{:8.1f} ms for {} strings ({:.2f} us each)'.format(parser.__name__, elapsed * 1000, len(peers), elapsed / len(peers) * 1e6))
+
+	unknown = {}
+	for versionStr, expected in corpus:
+		if expected is None:
+			pattern = versionPattern(versionStr)
+			unknown[pattern] = unknown.get(pattern, 0) + 1
+	print('not understood:')
+	for pattern, number in sorted(unknown.items(), key=lambda x: -x[1]):
+		print('{:12} time(s) {}'.format(number, pattern))
+	return 1 if failed else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
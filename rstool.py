@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+# single entry point for all scripts
+#
+#   ./rstool.py <subcommand> [json api options] [subcommand options]
+#
+# subcommands are imported only when they run, so the tool itself stays cheap to start.
+# target: `./rstool.py --help` within 5 ms of a bare `python3 -c pass` (no requests import),
+# check with `python3 -X importtime ./rstool.py --help`. A subcommand pays only for what it imports.
+
+import sys, importlib
+
+# subcommand -> (module, description)
+commands = {
+	'login': ('login', 'log into an account or shut the instance down'),
+	'ipoverview': ('ipOverview', 'connection statistics of all friends'),
+	'discoverview': ('discOverview', 'RetroShare versions used by friends'),
+	'bury': ('buryTheDead', 'move long offline friends into the graveyard group'),
+	'autoperms': ('autoPermissions', 'apply service permission rules'),
+	'resetperms': ('resetPermissions', 'reset, save or restore all service permissions'),
+	'chatbot': ('chatBot', 'run the chat bot'),
+	'chatwrap': ('chatWrapper', 'send the output of a report to a chat lobby'),
+	'daemon': ('rsDaemon', 'run the maintenance jobs periodically'),
+	'stats': ('rsStats', 'trends of the recorded discoverview / ipoverview numbers'),
+}
+
+def usage():
+	print('usage: rstool <subcommand> [options]')
+	print('')
+	print('subcommands:')
+	for name, (module, description) in commands.items():
+		print('  {:14}{}'.format(name, description))
+	print('')
+	print('json api options: --addr/-a --port/-p --user/-u --pass/-P, see rsApi.rsHost')
+
+def run(command: str, argv: list):
+	module = importlib.import_module(commands[command][0])
+
+	# the scripts read their options from sys.argv
+	oldArgv = sys.argv
+	sys.argv = [oldArgv[0] + ' ' + command] + list(argv)
+	try:
+		return module.main()
+	finally:
+		sys.argv = oldArgv
+
+def main():
+	if len(sys.argv) < 2 or sys.argv[1] in ['-h', '--help', 'help']:
+		usage()
+		return 0
+
+	command = sys.argv[1]
+	if command not in commands:
+		print('unknown subcommand ' + command)
+		usage()
+		return 1
+
+	return run(command, sys.argv[2:])
+
+
+if __name__ == "__main__":
+	sys.exit(main())